@@ -0,0 +1,283 @@
+""" Benchmark of the derivation and the urdf generation """
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import subprocess
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utility'))
+import networkx as nx
+from graph_compiler import GraphCompiler
+from urdf_compiler import UrdfCompiler
+from robot_generator import RandomDerivation
+
+PHASES = ['derive', 'load', 'auto_compile', 'generate_urdf']
+
+def count_matches(graph_compiler):
+    """ Returns the number of the targets of all the rules. """
+    return sum(len(targets) for targets in graph_compiler.get_applicable_rule().values())
+
+def run_case(g_robogrammar, g_compiler, seed, structure_rule_num):
+    """ Generates a robot and measures the time of each phase.
+
+    The phases are:
+        * derive: the random derivation with RoboGrammar.grammar (apply_rule and the rule choices).
+        * load: loading the derived graph into the compiler,
+                which searches the graph for the targets of all the rules from scratch.
+        * auto_compile: UrdfCompiler.auto_compile.
+        * generate_urdf: UrdfCompiler.generate_urdf into memory.
+
+    Args:
+        g_robogrammar(GraphCompiler): A compiler of RoboGrammar.grammar.
+        g_compiler(UrdfCompiler): A compiler of Compiler.grammar.
+        seed(int): The random seed for the derivation.
+        structure_rule_num(int): The number of the structure rule applications.
+
+    Returns:
+        dict: The times (seconds) of the phases in 'time', the number of the rewrites in the derivation,
+              the number of the targets found by the load phase, and the sizes of the graphs.
+
+    """
+    times = {}
+    g_robogrammar.initialize_graph()
+    derivation = RandomDerivation(g_robogrammar, random.Random(seed), structure_rule_num)
+    start = time.perf_counter()
+    rewrites = sum(1 for step in derivation)
+    times['derive'] = time.perf_counter() - start
+
+    graph = g_robogrammar.get_graph()
+    start = time.perf_counter()
+    g_compiler.load_graph(graph)
+    times['load'] = time.perf_counter() - start
+    matches = count_matches(g_compiler)
+
+    start = time.perf_counter()
+    g_compiler.auto_compile()
+    times['auto_compile'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    g_compiler.generate_urdf(robot_name='benchmark', filename=io.StringIO())
+    times['generate_urdf'] = time.perf_counter() - start
+
+    return {
+            'time': times,
+            'rewrites': rewrites,
+            'matches': matches,
+            'derived_nodes': graph.number_of_nodes(),
+            'compiled_nodes': g_compiler.get_graph().number_of_nodes()}
+
+def measure_peak_memory(g_robogrammar, g_compiler, seed, structure_rule_num):
+    """ Runs run_case under tracemalloc and returns the peak of the allocated memory in bytes. """
+    tracemalloc.start()
+    try:
+        run_case(g_robogrammar, g_compiler, seed, structure_rule_num)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmark(strnums, seeds, repeat=3, graph_class=nx.DiGraph, memory=True, grammar_dir=None):
+    """ Runs the benchmark for every pair of a structure_rule_num and a seed.
+
+    Each case is run repeat times and the shortest time of each phase is recorded.
+    The peak memory is measured in another run, since tracemalloc slows down the program.
+
+    Args:
+        strnums(list): The numbers of the structure rule applications.
+        seeds(list): The random seeds.
+        repeat(int): The number of the runs of each case.
+        graph_class(class): See the description of the GraphCompiler class.
+        memory(bool): If False, the peak memory is not measured.
+        grammar_dir(str or None): The directory containing the grammars and the urdf directory.
+                                  If None, the directory of this file is used.
+
+    Returns:
+        dict: The environment, the configuration, the result of each case and the summary.
+
+    """
+    if grammar_dir is None:
+        grammar_dir = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    g_robogrammar = GraphCompiler(os.path.join(grammar_dir, 'RoboGrammar.grammar'), graph_class=graph_class)
+    g_compiler = UrdfCompiler(
+            os.path.join(grammar_dir, 'Compiler.grammar'),
+            os.path.join(grammar_dir, 'urdf'),
+            initial_graph=None,
+            graph_class=graph_class,
+            show_progress=False)
+    setup_time = time.perf_counter() - start
+
+    cases = []
+    for structure_rule_num in strnums:
+        for seed in seeds:
+            case = {'strnum': structure_rule_num, 'seed': seed, 'error': None}
+            try:
+                runs = [run_case(g_robogrammar, g_compiler, seed, structure_rule_num) for i in range(repeat)]
+                case.update(runs[0])
+                case['time'] = {phase: min(run['time'][phase] for run in runs) for phase in PHASES}
+                case['time']['total'] = sum(case['time'].values())
+                case['matches_per_sec'] = case['matches'] / case['time']['load'] \
+                        if case['time']['load'] > 0 else None
+                if memory:
+                    case['peak_memory'] = measure_peak_memory(
+                            g_robogrammar, g_compiler, seed, structure_rule_num)
+            except (ValueError, KeyError) as e:
+                case['error'] = str(e)
+            cases.append(case)
+
+    return {
+            'environment': get_environment(),
+            'config': {
+                'strnums': list(strnums),
+                'seeds': list(seeds),
+                'repeat': repeat,
+                'graph_class': graph_class.__name__},
+            'setup_time': setup_time,
+            'cases': cases,
+            'summary': summarize(cases)}
+
+def summarize(cases):
+    """ Returns the medians of the times, the matches per second and the peak memory for each strnum. """
+    summary = {}
+    for structure_rule_num in sorted({case['strnum'] for case in cases}):
+        done = [case for case in cases if case['strnum'] == structure_rule_num and case['error'] is None]
+        if len(done) == 0:
+            continue
+        entry = {phase: statistics.median(case['time'][phase] for case in done) for phase in PHASES + ['total']}
+        rates = [case['matches_per_sec'] for case in done if case['matches_per_sec'] is not None]
+        if len(rates) != 0:
+            entry['matches_per_sec'] = statistics.median(rates)
+        if all('peak_memory' in case for case in done):
+            entry['peak_memory'] = statistics.median(case['peak_memory'] for case in done)
+        entry['derived_nodes'] = statistics.median(case['derived_nodes'] for case in done)
+        summary[str(structure_rule_num)] = entry
+    return summary
+
+def get_environment():
+    """ Returns the versions of python and networkx, the platform and the git commit if available. """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'networkx': nx.__version__,
+            'platform': platform.platform()}
+
+def get_environment_differences(result, baseline):
+    """ Returns the keys of the environment (except the commit) which differ between the results. """
+    environment = result.get('environment', {})
+    base_environment = baseline.get('environment', {})
+    return [key for key in ['python', 'networkx', 'platform']
+            if environment.get(key) != base_environment.get(key)]
+
+def compare(result, baseline, threshold=0.2, min_time=0.01):
+    """ Compares the summary of the result with that of the baseline.
+
+    The times are comparable only if the results are measured with the same configuration,
+    so a ValueError is raised if the configurations differ.
+    Check the environments with get_environment_differences.
+
+    Args:
+        result(dict): A result of run_benchmark.
+        baseline(dict): A result of run_benchmark saved before.
+        threshold(float): A phase is reported as a regression
+                          if its time is larger than that of the baseline by this ratio.
+        min_time(float): Phases shorter than this (seconds) in both results are ignored as noise.
+
+    Returns:
+        list: Tuples (strnum, phase, baseline_time, time) of the regressions.
+
+    """
+    config = result.get('config', {})
+    base_config = baseline.get('config', {})
+    differences = [key for key in ['graph_class', 'repeat', 'seeds', 'strnums']
+                   if config.get(key) != base_config.get(key)]
+    if len(differences) != 0:
+        raise ValueError("The configuration differs from the baseline: " + ', '.join(
+            key + ' = ' + str(config.get(key)) + ' (baseline: ' + str(base_config.get(key)) + ')'
+            for key in differences))
+
+    regressions = []
+    for structure_rule_num, entry in result['summary'].items():
+        if structure_rule_num not in baseline['summary']:
+            continue
+        base_entry = baseline['summary'][structure_rule_num]
+        for phase in PHASES + ['total']:
+            if max(entry[phase], base_entry[phase]) < min_time:
+                continue
+            if entry[phase] > base_entry[phase] * (1 + threshold):
+                regressions.append((structure_rule_num, phase, base_entry[phase], entry[phase]))
+    return regressions
+
+def print_summary(result):
+    """ Prints the summary as a table. """
+    columns = PHASES + ['total']
+    print("strnum " + ' '.join(phase.rjust(13) for phase in columns) + '  matches/s   peak[KiB]')
+    for structure_rule_num, entry in result['summary'].items():
+        row = structure_rule_num.rjust(6) + ' ' + \
+                ' '.join(('%.4f' % entry[phase]).rjust(13) for phase in columns)
+        if 'matches_per_sec' in entry:
+            row += ('%.0f' % entry['matches_per_sec']).rjust(11)
+        else:
+            row += '-'.rjust(11)
+        if 'peak_memory' in entry:
+            row += ('%.0f' % (entry['peak_memory'] / 1024)).rjust(12)
+        print(row)
+    for case in result['cases']:
+        if case['error'] is not None:
+            print("[ FAILED ] strnum = " + str(case['strnum']) + " seed = " + str(case['seed']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measures the derivation and the urdf generation')
+    parser.add_argument('--strnum', type=int, nargs='+', default=[10, 20, 40],
+            help='The numbers for the structure rule application')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3], help='The random seeds')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='The number of the runs of each case')
+    parser.add_argument('--compact', action='store_true', help='Use CompactDiGraph')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure the peak memory')
+    parser.add_argument('-o', '--output', help='A path to the JSON file of the result')
+    parser.add_argument('--compare', help='A path to the JSON file of a baseline result')
+    parser.add_argument('--threshold', type=float, default=0.2,
+            help='The ratio of the slowdown reported as a regression')
+    parser.add_argument('--min-time', type=float, default=0.01,
+            help='Phases shorter than this (seconds) are not compared with the baseline')
+    args = parser.parse_args()
+    if args.compare and args.repeat < 3:
+        parser.error('--compare requires --repeat 3 or more')
+
+    graph_class = nx.DiGraph
+    if args.compact:
+        from compact_graph import CompactDiGraph
+        graph_class = CompactDiGraph
+
+    result = run_benchmark(args.strnum, args.seeds, args.repeat, graph_class, not args.no_memory)
+    print_summary(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print("[ SAVED ] " + args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in get_environment_differences(result, baseline):
+            print("[ WARNING ] " + key + " differs from the baseline: " +
+                    str(baseline['environment'].get(key)) + " -> " + str(result['environment'].get(key)))
+        try:
+            regressions = compare(result, baseline, args.threshold, args.min_time)
+        except ValueError as e:
+            print("[ ERROR ] " + str(e))
+            sys.exit(2)
+        for structure_rule_num, phase, base_time, new_time in regressions:
+            print("[ REGRESSION ] strnum = " + structure_rule_num + " " + phase + ": " +
+                    '%.4f' % base_time + " -> " + '%.4f' % new_time)
+        if len(regressions) != 0:
+            sys.exit(1)
@@ -0,0 +1,504 @@
+""" Batch generation of random robots """
+
+import os
+import sys
+import json
+import random
+import hashlib
+import logging
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utility'))
+import networkx as nx
+from graph_compiler import GraphCompiler
+from urdf_compiler import UrdfCompiler
+from urdf_handler import UrdfModuleIndex
+from rule_profiler import RuleProfiler
+from derivation_trace import DerivationTrace
+from graph_hash import GraphHashSet, canonical_hash
+from structured_log import get_logger, log_event
+
+_logger = get_logger('derivation')
+
+STRUCTURE_RULES = ['r' + str(i) for i in range(1, 8)]
+COMPONENT_RULES = ['r' + str(i) for i in range(8, 30)]
+
+# The compilers of the current process, created once by init_worker.
+_compilers = None
+
+class RandomDerivation():
+    """ A random derivation of a robot graph driven by an explicit random number generator.
+
+    At first, the structure rules are applied structure_rule_num times at most.
+    Then, the component rules are applied until the graph becomes a sentence.
+    When no component rules are applicable, a structure rule is applied instead.
+
+    A rule is chosen uniformly from the applicable rules, and then a target is chosen uniformly.
+    The derivation depends only on the rng and the initial graph,
+    so the same seed always gives the same robot regardless of the process running it.
+
+    Iterating the object applies the rules one by one and yields (phase, rule_name, target),
+    where phase is 'structure', 'component' or 'restructure'.
+    Each step is also logged as a DEBUG 'derivation_step' event of the 'ggdl.derivation' logger.
+
+    Attributes:
+        g_robogrammar(GraphCompiler): A compiler of RoboGrammar.grammar.
+                                      The derivation starts from its current graph.
+        rng(random.Random or numpy.random.Generator): A random number generator.
+        structure_rule_num(int): The number of the structure rule applications.
+        structure_rules(list): The names of the structure rules.
+        component_rules(list): The names of the component rules.
+
+    """
+    def __init__(self, g_robogrammar, rng, structure_rule_num=10,
+            structure_rules=STRUCTURE_RULES, component_rules=COMPONENT_RULES):
+        self.g_robogrammar = g_robogrammar
+        self.rng = rng
+        self.structure_rule_num = structure_rule_num
+        self.structure_rules = structure_rules
+        self.component_rules = component_rules
+
+    def choose_rule(self, rule_names):
+        """ Chooses a rule in rule_names and its target. (None, None) if no rules are applicable. """
+        return self.g_robogrammar.sample_applicable_rule(self.rng, rule_names)
+
+    def __iter__(self):
+        for i in range(self.structure_rule_num):
+            rulename, target = self.choose_rule(self.structure_rules)
+            if rulename is None:
+                break
+            self.g_robogrammar.apply_rule(rulename, target)
+            if _logger.isEnabledFor(logging.DEBUG):
+                log_event(_logger, logging.DEBUG, 'derivation_step', phase='structure', rule=rulename, target=target)
+            yield 'structure', rulename, target
+
+        while not self.g_robogrammar.is_sentence():
+            phase = 'component'
+            rulename, target = self.choose_rule(self.component_rules)
+            if rulename is None:
+                phase = 'restructure'
+                rulename, target = self.choose_rule(self.structure_rules)
+            if rulename is None:
+                raise ValueError("No rules are applicable even though the graph is not a sentence.")
+            self.g_robogrammar.apply_rule(rulename, target)
+            if _logger.isEnabledFor(logging.DEBUG):
+                log_event(_logger, logging.DEBUG, 'derivation_step', phase=phase, rule=rulename, target=target)
+            yield phase, rulename, target
+
+    def run(self):
+        """ Applies the rules until the derivation finishes. """
+        for step in self:
+            pass
+
+def derive_seed(root_seed, index):
+    """ Derives the seed of the index-th robot from the root_seed.
+
+    The seed is computed from the SHA-256 hash of the pair,
+    so it does not depend on the order of the generation or on the process.
+
+    Args:
+        root_seed(int): The root seed of the batch.
+        index(int): The index of the robot.
+
+    """
+    digest = hashlib.sha256((str(root_seed) + ':' + str(index)).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def init_worker(grammar_dir, graph_class=nx.DiGraph, grammar_cache_dir=None, urdf_index_path=None,
+        profile=False):
+    """ Loads the grammars and the module urdf files once for the current process.
+
+    Args:
+        grammar_dir(str): The directory containing RoboGrammar.grammar, Compiler.grammar
+                          and the urdf directory.
+        graph_class(class): See the description of the GraphCompiler class.
+        grammar_cache_dir(str or None): See the description of the GraphCompiler class.
+        urdf_index_path(str or None): See the description of the UrdfCompiler class.
+        profile(bool): If True, RuleProfiler objects are set to the compilers.
+
+    """
+    global _compilers
+    _compilers = (
+            GraphCompiler(
+                os.path.join(grammar_dir, 'RoboGrammar.grammar'), 
+                graph_class=graph_class,
+                grammar_cache_dir=grammar_cache_dir),
+            UrdfCompiler(
+                os.path.join(grammar_dir, 'Compiler.grammar'),
+                os.path.join(grammar_dir, 'urdf'),
+                initial_graph=None,
+                graph_class=graph_class,
+                show_progress=False,
+                grammar_cache_dir=grammar_cache_dir,
+                urdf_index_path=urdf_index_path))
+    if profile:
+        for compiler in _compilers:
+            compiler.profiler = RuleProfiler()
+
+def generate_robot(seed, robot_name, outputdir, structure_rule_num, compress=False, trace=False):
+    """ Generates a robot with the compilers loaded by init_worker and writes it to the outputdir.
+
+    The urdf file and the gml file of the compiled graph are saved
+    as robot_name.urdf and robot_name.gml, respectively.
+
+    Args:
+        seed(int): The random seed for the derivation.
+        robot_name(str): The name of the robot.
+        outputdir(str): The output directory.
+        structure_rule_num(int): The number of the structure rule applications.
+        compress(bool): If True, the files are compressed with gzip and '.gz' is appended to their names.
+        trace(bool): If True, the rewrites of both the grammars are saved as robot_name.trace.json,
+                     from which replay_robot regenerates the robot without searching for the targets.
+
+    Returns:
+        dict: 'robot_name', 'seed', 'urdf', 'gml' and 'trace' (the paths to the files, or None on failure),
+              'hash' (canonical_hash of the compiled graph, or None on failure)
+              and 'error' (the error message, or None on success).
+              If the compilers are profiled, 'profile' is added, which holds RuleProfiler.to_dict()
+              of the compilers of RoboGrammar.grammar and Compiler.grammar as 'robogrammar' and 'compiler'.
+
+    """
+    def derive(g_robogrammar, g_compiler):
+        g_robogrammar.initialize_graph()
+        if trace:
+            g_robogrammar.start_trace({'seed': seed, 'structure_rule_num': structure_rule_num})
+        RandomDerivation(g_robogrammar, random.Random(seed), structure_rule_num).run()
+        g_compiler.load_graph(g_robogrammar.get_graph())
+        if trace:
+            g_compiler.start_trace()
+
+    return _build_robot({'robot_name': robot_name, 'seed': seed}, outputdir, compress, derive, trace)
+
+def replay_robot(trace_path, robot_name, outputdir, compress=False):
+    """ Regenerates a robot from the trace saved by generate_robot, without searching for the targets.
+
+    Args:
+        trace_path(str): A path to the trace file.
+        robot_name(str): The name of the robot.
+        outputdir(str): The output directory.
+        compress(bool): If True, the files are compressed with gzip and '.gz' is appended to their names.
+
+    Returns:
+        dict: The same as generate_robot. 'trace' is the trace_path.
+
+    """
+    try:
+        traces = load_robot_trace(trace_path)
+    except (OSError, ValueError, KeyError) as e:
+        return {'robot_name': robot_name, 'seed': None, 'urdf': None, 'gml': None, 'trace': trace_path,
+                'hash': None, 'error': str(e)}
+
+    def derive(g_robogrammar, g_compiler):
+        g_robogrammar.initialize_graph()
+        g_robogrammar.replay_trace(traces['robogrammar'])
+        g_compiler.load_graph(g_robogrammar.get_graph(), build_index=False)
+        g_compiler.replay_trace(traces['compiler'])
+
+    result = {'robot_name': robot_name, 'seed': traces['robogrammar'].metadata.get('seed')}
+    result = _build_robot(result, outputdir, compress, derive, False)
+    result['trace'] = trace_path
+    return result
+
+def save_robot_trace(path, robogrammar_trace, compiler_trace):
+    """ Saves the traces of RoboGrammar.grammar and Compiler.grammar of a robot as a JSON file. """
+    with open(path, 'w') as f:
+        json.dump({'robogrammar': robogrammar_trace.to_dict(), 'compiler': compiler_trace.to_dict()}, 
+                f, separators=(',', ':'))
+
+def load_robot_trace(path):
+    """ Loads the traces saved by save_robot_trace.
+
+    Returns:
+        dict: DerivationTrace objects of RoboGrammar.grammar and Compiler.grammar 
+              as 'robogrammar' and 'compiler'.
+
+    """
+    with open(path) as f:
+        data = json.load(f)
+    return {key: DerivationTrace.from_dict(data[key]) for key in ('robogrammar', 'compiler')}
+
+def _build_robot(result, outputdir, compress, derive, trace):
+    """ Runs derive(g_robogrammar, g_compiler), generates the urdf file and writes the files.
+
+    See generate_robot for the arguments and the returned value.
+
+    """
+    g_robogrammar, g_compiler = _compilers
+    robot_name = result['robot_name']
+    result.update({'urdf': None, 'gml': None, 'trace': None, 'hash': None, 'error': None})
+    if g_robogrammar.profiler is not None:
+        g_robogrammar.profiler.reset()
+        g_compiler.profiler.reset()
+        result['profile'] = {}
+    extension = '.gz' if compress else ''
+    urdf_filename = os.path.join(outputdir, robot_name + '.urdf' + extension)
+    gml_filename = os.path.join(outputdir, robot_name + '.gml' + extension)
+    try:
+        derive(g_robogrammar, g_compiler)
+        g_compiler.generate_urdf(robot_name=robot_name, filename=urdf_filename)
+    except (ValueError, KeyError) as e:
+        result['error'] = str(e)
+        return result
+    finally:
+        traces = (g_robogrammar.stop_trace(), g_compiler.stop_trace())
+        if 'profile' in result:
+            result['profile']['robogrammar'] = g_robogrammar.profiler.to_dict()
+            result['profile']['compiler'] = g_compiler.profiler.to_dict()
+    if trace:
+        result['trace'] = os.path.join(outputdir, robot_name + '.trace.json')
+        save_robot_trace(result['trace'], *traces)
+    graph = g_compiler.get_graph()
+    if not isinstance(graph, nx.DiGraph):
+        graph = graph.to_networkx()
+    nx.write_gml(graph, gml_filename)
+    result['urdf'] = urdf_filename
+    result['gml'] = gml_filename
+    result['hash'] = canonical_hash(graph)
+    return result
+
+def load_robot_graph(gml_filename):
+    """ Loads the compiled graph saved by generate_robot. """
+    return nx.read_gml(gml_filename)
+
+def remove_robot_files(result):
+    """ Removes the files of a robot written by generate_robot and sets None to their paths in the result. """
+    for key in ('urdf', 'gml', 'trace'):
+        if result[key] is not None:
+            os.remove(result[key])
+            result[key] = None
+
+def update_urdf_index(urdf_dir, urdf_index_path):
+    """ Brings the index of the module urdf files in the urdf_dir up to date. 
+
+    Args:
+        urdf_dir(str): The directory where module urdf files are stored.
+        urdf_index_path(str): A path to the index file.
+
+    """
+    urdf_index = UrdfModuleIndex(urdf_index_path)
+    for filename in sorted(os.listdir(urdf_dir)):
+        path = os.path.join(urdf_dir, filename)
+        if os.path.isfile(path):
+            urdf_index.get(path)
+    urdf_index.save()
+
+def merge_profiles(results):
+    """ Merges the profiles in the results of generate_robot.
+
+    Args:
+        results(iterable): The results of generate_robot (or generate_robots).
+
+    Returns:
+        dict: RuleProfiler objects of the compilers of RoboGrammar.grammar and Compiler.grammar
+              as 'robogrammar' and 'compiler'.
+
+    """
+    profilers = {'robogrammar': RuleProfiler(), 'compiler': RuleProfiler()}
+    for result in results:
+        for key, profile in result.get('profile', {}).items():
+            profilers[key].merge(profile)
+    return profilers
+
+def _call(args):
+    function, task = args
+    return function(*task)
+
+def _run_tasks(function, tasks, workers, initargs):
+    """ Calls function(*task) for each task in the worker processes and yields the results in order. """
+    if workers == 1:
+        init_worker(*initargs)
+        for task in tasks:
+            yield function(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers,
+            initializer=init_worker, initargs=initargs) as executor:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        yield from executor.map(_call, [(function, task) for task in tasks], chunksize=chunksize)
+
+def generate_robots(n, seeds=None, workers=None, outputdir='./generated_robots',
+        structure_rule_num=10, name_prefix='robot_', grammar_dir=None, graph_class=nx.DiGraph,
+        root_seed=0, first_index=0, grammar_cache_dir=None, urdf_index_path=None, compress=False,
+        profile=False, trace=False, unique=False):
+    """ Generates n robots in parallel and yields the results in the order of the robots.
+
+    Each worker process loads the grammars and the module urdf files once,
+    and writes the urdf and gml files of each robot as soon as it is generated.
+    A robot generated with a seed is the same as the one test_random_robot.py generates
+    with the same seed and structure_rule_num.
+
+    The robots are numbered from first_index, and the k-th robot is named name_prefix + str(k).
+    Unless the seeds are given, the seed of the k-th robot is derive_seed(root_seed, k).
+    Therefore, the k-th robot is identical whichever batch or worker generates it.
+
+    Different seeds often result in the same robot with different node IDs.
+    Such a robot is found by the hash of its compiled graph,
+    and 'duplicate_of' of its result is set to the name of the first robot of the same structure.
+    The graphs are compared only when their hashes are the same.
+
+    Args:
+        n(int): The number of robots.
+        seeds(list or None): The random seeds for the robots. If None, derived from root_seed.
+        workers(int or None): The number of worker processes. If None, the number of the CPUs is used.
+                              If 1, the robots are generated in the current process.
+        outputdir(str): The output directory. Created if it does not exist.
+        structure_rule_num(int): The number of the structure rule applications.
+        name_prefix(str): The robot names are name_prefix followed by the indices of the robots.
+        grammar_dir(str or None): See init_worker. If None, the directory of this file is used.
+        graph_class(class): See the description of the GraphCompiler class.
+        root_seed(int): The root seed of the batch.
+        first_index(int): The index of the first robot.
+        grammar_cache_dir(str or None): See the description of the GraphCompiler class.
+        urdf_index_path(str or None): See the description of the UrdfCompiler class.
+                                      The index is brought up to date before the workers start,
+                                      so that the workers only read it.
+        compress(bool): If True, the output files are compressed with gzip.
+        profile(bool): If True, the costs of the rules are measured. See generate_robot and merge_profiles.
+        trace(bool): If True, the trace of each robot is saved. See generate_robot and replay_robots.
+        unique(bool): If True, the files of the duplicated robots are removed.
+
+    Yields:
+        dict: The result of generate_robot for each robot, with 'duplicate_of'
+              (the name of the robot of the same structure generated before, or None).
+
+    """
+    if seeds is None:
+        seeds = [derive_seed(root_seed, k) for k in range(first_index, first_index + n)]
+    else:
+        seeds = list(seeds)
+        if len(seeds) < n:
+            raise ValueError("The number of the seeds is less than " + str(n) + ".")
+        seeds = seeds[:n]
+    if grammar_dir is None:
+        grammar_dir = os.path.dirname(os.path.abspath(__file__))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(outputdir, exist_ok=True)
+
+    tasks = [(seed, name_prefix + str(k), outputdir, structure_rule_num, compress, trace)
+            for k, seed in zip(range(first_index, first_index + n), seeds)]
+    if urdf_index_path is not None:
+        update_urdf_index(os.path.join(grammar_dir, 'urdf'), urdf_index_path)
+    initargs = (grammar_dir, graph_class, grammar_cache_dir, urdf_index_path, profile)
+    generated = GraphHashSet()
+    for result in _run_tasks(generate_robot, tasks, workers, initargs):
+        result['duplicate_of'] = None
+        if result['error'] is None:
+            result['duplicate_of'] = generated.add(result['robot_name'],
+                    functools.partial(load_robot_graph, result['gml']), result['hash'])
+            if unique and result['duplicate_of'] is not None:
+                remove_robot_files(result)
+        yield result
+
+def replay_robots(trace_paths, workers=None, outputdir='./generated_robots', grammar_dir=None,
+        graph_class=nx.DiGraph, grammar_cache_dir=None, urdf_index_path=None, compress=False, profile=False):
+    """ Regenerates robots from their traces in parallel and yields the results in the order of the traces.
+
+    The robot of a trace file 'name.trace.json' is named 'name'.
+    See generate_robots for the other arguments.
+
+    Args:
+        trace_paths(list): Paths to the trace files saved by generate_robot.
+
+    Yields:
+        dict: The result of replay_robot for each robot.
+
+    """
+    if grammar_dir is None:
+        grammar_dir = os.path.dirname(os.path.abspath(__file__))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(outputdir, exist_ok=True)
+
+    tasks = []
+    for trace_path in trace_paths:
+        robot_name = os.path.basename(trace_path)
+        if robot_name.endswith('.trace.json'):
+            robot_name = robot_name[:-len('.trace.json')]
+        tasks.append((trace_path, robot_name, outputdir, compress))
+    if urdf_index_path is not None:
+        update_urdf_index(os.path.join(grammar_dir, 'urdf'), urdf_index_path)
+    initargs = (grammar_dir, graph_class, grammar_cache_dir, urdf_index_path, profile)
+    yield from _run_tasks(replay_robot, tasks, workers, initargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Randomly generates robot urdf files in parallel')
+    parser.add_argument('-n', '--number', type=int, default=10, help='The number of robots')
+    parser.add_argument('--seed', type=int, default=0, help='The root seed of the batch')
+    parser.add_argument('--start', type=int, default=0, help='The index of the first robot')
+    parser.add_argument('--strnum', type=int, default=10,
+            help='An integer for the number for the structure rule application')
+    parser.add_argument('-w', '--workers', type=int, help='The number of worker processes')
+    parser.add_argument('-o', '--outputdir', default='./generated_robots', help='An output directory')
+    parser.add_argument('--compact', action='store_true', help='Use CompactDiGraph for the derivation')
+    parser.add_argument('--gzip', action='store_true', help='Compress the output files with gzip')
+    parser.add_argument('--profile', 
+            help='A directory where the tables of the costs of the rules are saved as csv files')
+    parser.add_argument('--cache-dir', 
+            help='A directory for the cache of the parsed grammars and the module urdf files')
+    parser.add_argument('--trace', action='store_true',
+            help='Save the trace of each robot as robot_name.trace.json')
+    parser.add_argument('--replay', nargs='+', metavar='TRACE',
+            help='Regenerate the robots from the trace files instead of the random derivation')
+    parser.add_argument('--unique', action='store_true',
+            help='Remove the robots of the same structure as the robots generated before')
+    args = parser.parse_args()
+
+    graph_class = nx.DiGraph
+    if args.compact:
+        from compact_graph import CompactDiGraph
+        graph_class = CompactDiGraph
+
+    urdf_index_path = None if args.cache_dir is None else os.path.join(args.cache_dir, 'urdf_index.json')
+    if args.replay is not None:
+        args.number = len(args.replay)
+        robots = replay_robots(
+                args.replay,
+                workers=args.workers,
+                outputdir=args.outputdir,
+                graph_class=graph_class,
+                grammar_cache_dir=args.cache_dir,
+                urdf_index_path=urdf_index_path,
+                compress=args.gzip,
+                profile=args.profile is not None)
+    else:
+        robots = generate_robots(
+                args.number,
+                workers=args.workers,
+                outputdir=args.outputdir,
+                structure_rule_num=args.strnum,
+                graph_class=graph_class,
+                root_seed=args.seed,
+                first_index=args.start,
+                grammar_cache_dir=args.cache_dir,
+                urdf_index_path=urdf_index_path,
+                compress=args.gzip,
+                profile=args.profile is not None,
+                trace=args.trace,
+                unique=args.unique)
+
+    failed = 0
+    duplicated = 0
+    results = []
+    for result in robots:
+        results.append(result)
+        if result.get('duplicate_of') is not None:
+            duplicated += 1
+            print("[ DUPLICATED ] " + result['robot_name'] + " = " + result['duplicate_of'])
+        elif result['error'] is None:
+            print("[ DONE ] " + result['urdf'])
+        else:
+            failed += 1
+            print("[ FAILED ] " + result['robot_name'] + " (seed = " + str(result['seed']) + ")")
+            print(result['error'])
+    print("[ GENERATED ] " + str(args.number - failed) + " / " + str(args.number))
+    if args.replay is None:
+        print("[ UNIQUE ] " + str(args.number - failed - duplicated) + " / " + str(args.number - failed))
+    if args.profile is not None:
+        os.makedirs(args.profile, exist_ok=True)
+        for key, profiler in merge_profiles(results).items():
+            path = os.path.join(args.profile, key + '_profile.csv')
+            profiler.write_csv(path)
+            print("[ PROFILE ] " + path)
@@ -3,27 +3,15 @@ import sys
 import random
 import datetime
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 sys.path.insert(0, os.path.abspath('../utility'))
 from graph_compiler import GraphCompiler 
 from urdf_compiler import UrdfCompiler 
+from compact_graph import CompactDiGraph
+from robot_generator import RandomDerivation
+from structured_log import enable_json_log, disable_json_log
 from test_robot_gen import *
 
-def get_random_rule(rulelist, choice):
-    applicable_rule = {}
-    #print("choice = " + str(choice))
-    for key in choice:
-        if key not in rulelist:
-            continue
-        if len(choice[key]) != 0:
-            applicable_rule[key] = choice[key]
-    if len(applicable_rule) != 0:
-        rulename = random.choice(list(applicable_rule.keys()))
-        target = random.choice(applicable_rule[rulename])
-    else:
-        rulename = None
-        target = None
-    return rulename, target
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Randomly generates a robot urdf file')
@@ -31,6 +19,11 @@ if __name__ == "__main__":
     parser.add_argument('--seed', help='An integer for random seed')
     parser.add_argument('--strnum', help='An integer for the number for the structure rule application')
     parser.add_argument('-o', '--outputdir', help='An output directory')
+    parser.add_argument('--compact', action='store_true', help='Use CompactDiGraph for the derivation')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print each rule application')
+    parser.add_argument('--log', help='A path to a file where the derivation is logged as JSON lines')
+    parser.add_argument('--match-workers', type=int, 
+            help='The number of worker processes searching for the targets of the compiler rules')
 
     args = parser.parse_args()
     if args.robot_name:
@@ -41,8 +34,10 @@ if __name__ == "__main__":
         now = datetime.datetime.now(jst)
         robot_name = "robot_" + now.strftime('%Y%m%d%H%M%S')
     if args.seed:
-        random.seed(int(args.seed))
+        rng = random.Random(int(args.seed))
         print("seed = " + args.seed)
+    else:
+        rng = random.Random()
     if args.outputdir:
         outputdir = args.outputdir
         if not outputdir.endswith('/'):
@@ -54,38 +49,34 @@ if __name__ == "__main__":
         structure_rule_num = int(args.strnum)
     else:
         structure_rule_num = 10 
+    if args.compact:
+        graph_class = CompactDiGraph
+    else:
+        graph_class = nx.DiGraph
+    log_handler = None
+    if args.log:
+        log_handler = enable_json_log(args.log)
+    executor = None
+    if args.match_workers:
+        executor = ProcessPoolExecutor(max_workers=args.match_workers)
 
 
 
     print("\n[ STRUCTURE ]")
-    g_robogrammar = GraphCompiler('./RoboGrammar.grammar')
-    structure_rulelist = ['r' + str(i) for i in range(1, 8)]
-
-    for i in range(structure_rule_num):
-        choices = g_robogrammar.get_applicable_rule()
-        rulename, target = get_random_rule(structure_rulelist, choices)
-        if rulename is None:
-            break
-        print("[ RULE ] " + rulename + " [ TARGET ] " + str(target))
-        g_robogrammar.apply_rule(rulename, target)
-
-    print("\n[ COMPONENT-BASED ]")
-    component_rulelist = ['r' + str(i) for i in range(8, 30)]
+    g_robogrammar = GraphCompiler('./RoboGrammar.grammar', graph_class=graph_class)
+    derivation = RandomDerivation(g_robogrammar, rng, structure_rule_num)
 
+    phase = 'structure'
     try:
-        while not g_robogrammar.is_sentence():
-            #print("is sentence ? = " + str(g_robogrammar.is_sentence()))
-            choices = g_robogrammar.get_applicable_rule()
-            rulename, target = get_random_rule(component_rulelist, choices)
-            if rulename is None:
-                if not g_robogrammar.is_sentence():
-                    print('Re-STRUCTURE RULE')
-                    rulename, target = get_random_rule(structure_rulelist, choices)
-                else:
-                    break
-            print("[ RULE ] " + rulename + " [ TARGET ] " + str(target))
-            g_robogrammar.apply_rule(rulename, target)
-    except TypeError as e:
+        for step_phase, rulename, target in derivation:
+            if phase == 'structure' and step_phase != 'structure':
+                print("\n[ COMPONENT-BASED ]")
+            if step_phase == 'restructure':
+                print('Re-STRUCTURE RULE')
+            phase = step_phase
+            if not args.quiet:
+                print("[ RULE ] " + rulename + " [ TARGET ] " + str(target))
+    except ValueError as e:
         print(e)
         prompt(g_robogrammar)
 
@@ -93,7 +84,11 @@ if __name__ == "__main__":
         g_compiler = UrdfCompiler(
                     './Compiler.grammar',
                     './urdf', 
-                    initial_graph=g_robogrammar.get_graph()
+                    initial_graph=g_robogrammar.get_graph(),
+                    graph_class=graph_class,
+                    show_progress=not args.quiet,
+                    executor=executor,
+                    executor_workers=args.match_workers
                     )
     except ValueError as e:
         print(e)
@@ -103,12 +98,17 @@ if __name__ == "__main__":
         g_compiler = UrdfCompiler(
                     './Compiler.grammar',
                     './urdf', 
-                    initial_graph=g_robogrammar.get_graph()
+                    initial_graph=g_robogrammar.get_graph(),
+                    graph_class=graph_class,
+                    show_progress=not args.quiet,
+                    executor=executor,
+                    executor_workers=args.match_workers
                     )
 
     try:
         g_compiler.generate_urdf(robot_name=robot_name, filename=filename)
-        nx.write_gml(g_compiler.get_graph(), outputdir + 'result.gml')
+        result_graph = get_networkx_graph(g_compiler)
+        nx.write_gml(result_graph, outputdir + 'result.gml')
     except ValueError as e:
         print(e)
         prompt(g_compiler)
@@ -116,3 +116,8 @@ if __name__ == "__main__":
         print(e)
         prompt(g_compiler)
 
+
+    if executor is not None:
+        executor.shutdown()
+    if log_handler is not None:
+        disable_json_log(log_handler)
@@ -133,11 +133,18 @@ def input_and_parse(choices):
     else:
         return cmd, arg
 
+def get_networkx_graph(gc):
+    """ Returns the graph of the compiler as a networkx DiGraph, converting a CompactDiGraph. """
+    graph = gc.get_graph()
+    if not isinstance(graph, nx.DiGraph):
+        graph = graph.to_networkx()
+    return graph
+
 def exec_cmd(cmd, arg, gc, choices):
     if cmd == 'end':
         return True
     elif cmd == 'show':
-        graph = gc.get_graph()
+        graph = get_networkx_graph(gc)
         symbol_label = nx.get_node_attributes(graph, 'name')
         symbol_pos = {}
         id_label = {}
@@ -168,7 +175,7 @@ def exec_cmd(cmd, arg, gc, choices):
         except IndexError:
             dc.deco_print("<Error: Wrong Index>", color)
     elif cmd == 'save':
-        nx.write_gml(gc.get_graph(), arg)
+        nx.write_gml(get_networkx_graph(gc), arg)
 
 def show_nodes(graph, indent_num=4):
     print("[ NODES ]")
@@ -205,7 +212,6 @@ def show_choices(choices, indent_num=4):
 def prompt(gc, indent_num=4):
     finishp = False
     while not finishp:
-        graph = gc.get_graph()
         choices = gc.get_applicable_rule()
         cmd, arg = input_and_parse(choices)
         finishp = exec_cmd(cmd, arg, gc, choices)
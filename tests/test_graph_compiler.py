@@ -0,0 +1,62 @@
+""" Tests of GraphCompiler """
+
+import os
+import sys
+import unittest
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '../utility'))
+import networkx as nx
+from graph_compiler import GraphCompiler
+
+ROBOGRAMMAR_PATH = os.path.join(HERE, '../sample/RoboGrammar.grammar')
+
+def apply_first_rules(compiler, steps):
+    """ Applies the first applicable rule to its first target at most steps times. """
+    for i in range(steps):
+        for rule_name, targets in compiler.get_applicable_rule().items():
+            if len(targets) != 0:
+                compiler.apply_rule(rule_name, targets[0])
+                break
+        else:
+            return
+
+
+class LoadGraphTest(unittest.TestCase):
+    def test_ids_of_loaded_graph_are_not_reused(self):
+        # The IDs from 1 to 14 are free, but the ID of the isolated node must not be handed out.
+        graph = nx.DiGraph()
+        graph.add_node(0, name='S')
+        graph.add_node(15, name='empty')
+        compiler = GraphCompiler(ROBOGRAMMAR_PATH, graph=graph)
+        apply_first_rules(compiler, 40)
+
+        result = compiler.get_graph()
+        self.assertGreater(result.number_of_nodes(), 20)
+        self.assertEqual(result.nodes[15]['name'], 'empty')
+        self.assertEqual(result.degree(15), 0)
+
+
+class ApplyRulesBatchTest(unittest.TestCase):
+    def test_same_as_applying_one_by_one(self):
+        # The nodes replaced in the same batch are adjacent, e.g. B, H and T after r1.
+        batch_compiler = GraphCompiler(ROBOGRAMMAR_PATH)
+        serial_compiler = GraphCompiler(ROBOGRAMMAR_PATH)
+        for i in range(5):
+            rewrites = []
+            for rule_name, targets in batch_compiler.get_applicable_rule().items():
+                rewrites.extend((rule_name, target) for target in targets 
+                        if target not in [t for r, t in rewrites])
+            batch_compiler.apply_rules_batch(rewrites)
+            for rule_name, target in rewrites:
+                serial_compiler.apply_rule(rule_name, target)
+
+            batch_graph = batch_compiler.get_graph()
+            serial_graph = serial_compiler.get_graph()
+            self.assertEqual(dict(batch_graph.nodes(data=True)), dict(serial_graph.nodes(data=True)))
+            self.assertEqual({(u, v): d for u, v, d in batch_graph.edges(data=True)}, 
+                    {(u, v): d for u, v, d in serial_graph.edges(data=True)})
+            self.assertEqual(batch_compiler.get_applicable_rule(), serial_compiler.get_applicable_rule())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+""" Tests of IdAllocator """
+
+import os
+import sys
+import unittest
+import tracemalloc
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '../utility'))
+from id_allocator import IdAllocator
+
+
+class IdAllocatorTest(unittest.TestCase):
+    def test_reserve_huge_sparse_id(self):
+        allocator = IdAllocator()
+        tracemalloc.start()
+        try:
+            allocator.reserve([0, 1, 5000000])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1024 * 1024)
+        self.assertEqual(len(allocator), 3)
+        self.assertEqual(allocator.pop_many(3), [2, 3, 4])
+        self.assertEqual(len(allocator), 6)
+
+    def test_gaps_are_handed_out_in_increasing_order_after_released_ids(self):
+        allocator = IdAllocator()
+        allocator.reserve([1, 4])
+        allocator.push(4)
+        self.assertEqual(allocator.pop_many(5), [4, 0, 2, 3, 5])
+
+    def test_reserve_inside_gap(self):
+        allocator = IdAllocator()
+        allocator.reserve([10])
+        allocator.reserve([0, 5, 9])
+        self.assertEqual(len(allocator), 4)
+        self.assertEqual(allocator.pop_many(7), [1, 2, 3, 4, 6, 7, 8])
+        self.assertEqual(allocator.pop(), 11)
+
+    def test_push_rejects_unused_ids(self):
+        allocator = IdAllocator()
+        allocator.reserve([0, 100])
+        for node_id in (50, 100 + 1):
+            with self.assertRaises(ValueError):
+                allocator.push(node_id)
+        allocator.push(100)
+        with self.assertRaises(ValueError):
+            allocator.push(100)
+
+    def test_copy_is_independent(self):
+        allocator = IdAllocator()
+        allocator.reserve([3])
+        snapshot = allocator.copy()
+        self.assertEqual(allocator.pop_many(2), [0, 1])
+        self.assertEqual(snapshot.pop_many(4), [0, 1, 2, 4])
+
+    def test_copy_shares_free_ids_until_modified(self):
+        allocator = IdAllocator()
+        allocator.pop_many(100000)
+        for node_id in range(0, 100000, 2):
+            allocator.push(node_id)
+        tracemalloc.start()
+        try:
+            snapshot = allocator.copy()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 4096)
+
+        self.assertEqual(allocator.pop(), 99998)
+        snapshot.push(99999)
+        self.assertEqual(snapshot.pop_many(2), [99999, 99998])
+        self.assertEqual(allocator.pop(), 99996)
+        self.assertEqual(len(allocator), 50002)
+        self.assertEqual(len(snapshot), 50001)
+
+
+if __name__ == '__main__':
+    unittest.main()
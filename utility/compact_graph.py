@@ -0,0 +1,331 @@
+""" CompactDiGraph """
+
+from array import array
+from types import MappingProxyType
+
+class LabelTable():
+    """ A table interning label dictionaries of nodes and edges.
+
+    Each distinct label dictionary is stored once and identified by an integer.
+    The stored dictionaries are read-only (MappingProxyType),
+    since they are shared by all the nodes and edges with the same labels.
+    The table only grows, so the integers never change once they are assigned.
+
+    Attributes:
+        labels(list): The read-only label dictionaries. The index is the integer of the label.
+        label_ids(dict): A dictionary which takes a key made from a label dictionary
+                         and returns the integer of the label.
+
+    """
+    def __init__(self):
+        self.labels = []
+        self.label_ids = {}
+
+    def intern(self, label_dict):
+        """ Returns the integer of the label dictionary, adding it into the table if needed.
+
+        Args:
+            label_dict(dict): A label dictionary. The values must be hashable.
+
+        """
+        key = tuple(sorted(label_dict.items()))
+        try:
+            return self.label_ids[key]
+        except KeyError:
+            pass
+        label_id = len(self.labels)
+        self.labels.append(MappingProxyType(dict(label_dict)))
+        self.label_ids[key] = label_id
+        return label_id
+
+    def __getitem__(self, label_id):
+        return self.labels[label_id]
+
+
+class CompactNodeRecord():
+    """ A record of a node of CompactDiGraph.
+
+    The adjacency is stored in arrays of integers.
+    succ (pred) holds the ID of each successor (predecessor) followed by
+    the integer of the label of the edge, i.e. [node_id_0, label_id_0, node_id_1, label_id_1, ...].
+
+    Attributes:
+        label(int): The integer of the label of the node.
+        succ(array): The successors and the labels of the edges to them.
+        pred(array): The predecessors and the labels of the edges from them.
+
+    """
+    __slots__ = ('label', 'succ', 'pred')
+
+    def __init__(self, label, succ=None, pred=None):
+        self.label = label
+        self.succ = array('q') if succ is None else array('q', succ)
+        self.pred = array('q') if pred is None else array('q', pred)
+
+
+class CompactNodeView():
+    """ A view of the nodes of CompactDiGraph, which works as the DiGraph.nodes of the networkx. """
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, node_id):
+        return self.graph.labels[self.graph.records[node_id].label]
+
+    def __contains__(self, node_id):
+        return node_id in self.graph.records
+
+    def __iter__(self):
+        return iter(self.graph.records)
+
+    def __len__(self):
+        return len(self.graph.records)
+
+    def __call__(self, data=False):
+        if data:
+            return [(node_id, self.graph.labels[record.label])
+                    for node_id, record in self.graph.records.items()]
+        return list(self.graph.records)
+
+
+class CompactDiGraph():
+    """ A directed graph with labelled nodes and edges, stored compactly.
+
+    This class is an alternative of the networkx DiGraph for GraphCompiler.
+    The label dictionaries are interned in a LabelTable,
+    and each node is a CompactNodeRecord which holds the adjacency in arrays of integers.
+    Therefore, a graph whose labels are only a few symbols consumes much less memory
+    than the networkx DiGraph, which holds a dictionary for every node and edge.
+
+    This class implements the subset of the API of the networkx DiGraph used by
+    the rules of grammar.py and GraphCompiler.
+    The orders of the nodes and the edges are the same as the ones of the networkx DiGraph.
+
+    Note:
+        The node IDs must be integers.
+        The label dictionaries returned by this class are read-only.
+        To change a label, add the node or the edge again with the new label.
+
+    Attributes:
+        labels(LabelTable): The label table. Shared with the copies of the graph.
+        records(dict): A dictionary which takes a node ID and returns the CompactNodeRecord.
+
+    """
+    def __init__(self, labels=None):
+        """
+        Args:
+            labels(LabelTable or None): The label table to be shared. If None, a new table is created.
+
+        """
+        self.labels = LabelTable() if labels is None else labels
+        self.records = {}
+
+    @property
+    def nodes(self):
+        """ Returns a CompactNodeView of the graph. """
+        return CompactNodeView(self)
+
+    def __contains__(self, node_id):
+        return node_id in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def number_of_nodes(self):
+        """ Returns the number of the nodes. """
+        return len(self.records)
+
+    def number_of_edges(self):
+        """ Returns the number of the edges. """
+        return sum(len(record.succ) for record in self.records.values()) // 2
+
+    def has_node(self, node_id):
+        """ Checks if the graph has the node. """
+        return node_id in self.records
+
+    def has_edge(self, start_id, end_id):
+        """ Checks if the graph has the edge from start_id to end_id. """
+        try:
+            return self.__find(self.records[start_id].succ, end_id) >= 0
+        except KeyError:
+            return False
+
+    def in_edges(self, node_id, data=False):
+        """ Returns a list of the edges ending with the node.
+
+        Args:
+            node_id(int): The ID of the node.
+            data(bool, optional): If True, each element of the returned list
+                                  is a tuple (start_node_id, end_node_id, label_dict).
+
+        """
+        pred = self.records[node_id].pred
+        if data:
+            return [(pred[i], node_id, self.labels[pred[i + 1]]) for i in range(0, len(pred), 2)]
+        return [(pred[i], node_id) for i in range(0, len(pred), 2)]
+
+    def out_edges(self, node_id, data=False):
+        """ Returns a list of the edges starting from the node.
+
+        Args:
+            node_id(int): The ID of the node.
+            data(bool, optional): If True, each element of the returned list
+                                  is a tuple (start_node_id, end_node_id, label_dict).
+
+        """
+        succ = self.records[node_id].succ
+        if data:
+            return [(node_id, succ[i], self.labels[succ[i + 1]]) for i in range(0, len(succ), 2)]
+        return [(node_id, succ[i]) for i in range(0, len(succ), 2)]
+
+    def edges(self, data=False):
+        """ Returns a list of all the edges.
+
+        Args:
+            data(bool, optional): If True, each element of the returned list
+                                  is a tuple (start_node_id, end_node_id, label_dict).
+
+        """
+        ret = []
+        for node_id in self.records:
+            ret.extend(self.out_edges(node_id, data=data))
+        return ret
+
+    def add_node(self, node_id, **label_dict):
+        """ Adds a node. If the node exists, its label is updated with the label_dict. """
+        try:
+            record = self.records[node_id]
+        except KeyError:
+            self.records[node_id] = CompactNodeRecord(self.labels.intern(label_dict))
+            return
+        if len(label_dict) != 0:
+            record.label = self.labels.intern({**self.labels[record.label], **label_dict})
+
+    def add_nodes_from(self, nodes):
+        """ Adds nodes.
+
+        Args:
+            nodes(iterable): Each element is a node ID or a tuple (node_id, label_dict).
+
+        """
+        for node in nodes:
+            if isinstance(node, tuple):
+                self.add_node(node[0], **node[1])
+            else:
+                self.add_node(node)
+
+    def add_edge(self, start_id, end_id, **label_dict):
+        """ Adds an edge. If the edge exists, its label is updated with the label_dict.
+
+        The nodes which do not exist are added as ones without labels.
+
+        """
+        self.add_node(start_id)
+        self.add_node(end_id)
+        succ = self.records[start_id].succ
+        i = self.__find(succ, end_id)
+        if i < 0:
+            label_id = self.labels.intern(label_dict)
+            succ.extend((end_id, label_id))
+            self.records[end_id].pred.extend((start_id, label_id))
+            return
+        if len(label_dict) == 0:
+            return
+        label_id = self.labels.intern({**self.labels[succ[i + 1]], **label_dict})
+        succ[i + 1] = label_id
+        pred = self.records[end_id].pred
+        pred[self.__find(pred, start_id) + 1] = label_id
+
+    def add_edges_from(self, edges):
+        """ Adds edges.
+
+        Args:
+            edges(iterable): Each element is a tuple (start_node_id, end_node_id)
+                             or (start_node_id, end_node_id, label_dict).
+
+        """
+        for edge in edges:
+            if len(edge) == 3:
+                self.add_edge(edge[0], edge[1], **edge[2])
+            else:
+                self.add_edge(edge[0], edge[1])
+
+    def remove_node(self, node_id):
+        """ Removes the node and the edges connecting with it.
+
+        Raises:
+            KeyError: The node does not exist.
+
+        """
+        record = self.records.pop(node_id)
+        for i in range(0, len(record.succ), 2):
+            if record.succ[i] != node_id:
+                self.__remove(self.records[record.succ[i]].pred, node_id)
+        for i in range(0, len(record.pred), 2):
+            if record.pred[i] != node_id:
+                self.__remove(self.records[record.pred[i]].succ, node_id)
+
+    def remove_nodes_from(self, node_ids):
+        """ Removes the nodes. The nodes which do not exist are ignored. """
+        for node_id in node_ids:
+            if node_id in self.records:
+                self.remove_node(node_id)
+
+    def remove_edge(self, start_id, end_id):
+        """ Removes the edge.
+
+        Raises:
+            KeyError: The edge does not exist.
+
+        """
+        if not self.has_edge(start_id, end_id):
+            raise KeyError((start_id, end_id))
+        self.__remove(self.records[start_id].succ, end_id)
+        self.__remove(self.records[end_id].pred, start_id)
+
+    def copy(self):
+        """ Returns a copy of the graph. The label table is shared. """
+        graph = self.__class__(self.labels)
+        graph.records = {node_id: CompactNodeRecord(record.label, record.succ, record.pred)
+                for node_id, record in self.records.items()}
+        return graph
+
+    def to_networkx(self):
+        """ Generates a networkx DiGraph with the same nodes, edges and labels. """
+        import networkx
+        g = networkx.DiGraph()
+        g.add_nodes_from([(node_id, dict(label_dict)) for node_id, label_dict in self.nodes(data=True)])
+        g.add_edges_from([(edge[0], edge[1], dict(edge[2])) for edge in self.edges(data=True)])
+        return g
+
+    @classmethod
+    def from_graph(cls, graph, labels=None):
+        """ Generates a CompactDiGraph with the same nodes, edges and labels as the given graph.
+
+        Args:
+            graph(DiGraph or CompactDiGraph): The graph to be converted.
+            labels(LabelTable or None): The label table to be shared.
+
+        """
+        g = cls(labels)
+        g.add_nodes_from(graph.nodes(data=True))
+        g.add_edges_from(graph.edges(data=True))
+        return g
+
+    @classmethod
+    def __find(cls, adjacency, node_id):
+        """ Returns the index of the node in the adjacency array, or -1. """
+        for i in range(0, len(adjacency), 2):
+            if adjacency[i] == node_id:
+                return i
+        return -1
+
+    @classmethod
+    def __remove(cls, adjacency, node_id):
+        """ Removes the node and the label following it from the adjacency array. """
+        i = cls.__find(adjacency, node_id)
+        del adjacency[i:i + 2]
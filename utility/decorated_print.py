@@ -23,6 +23,7 @@ class DecoratedPrint():
         bg_blue(string): Escape sequence for bg_blue
         bg_magenta(string): Escape sequence for bg_magenta
         bg_cyan(string): Escape sequence for bg_cyan
+        enabled(bool): If False, deco_print neither formats nor prints anything.
     
     """
     ## Public attributes
@@ -45,6 +46,7 @@ class DecoratedPrint():
     bg_cyan = "\033[46m"
     bg_white = "\033[47m"
     reset = "\033[0m"
+    enabled = True
 
     ## Public class methods
     @classmethod
@@ -73,6 +75,8 @@ class DecoratedPrint():
             args(strings): Decoration specifiers. Use the class attributions.
             
         """
+        if not cls.enabled:
+            return None
         return print(DecoratedPrint.decorated_string(string, *args))
 
 
@@ -0,0 +1,86 @@
+""" DerivationTrace """
+
+import json
+
+class DerivationTrace():
+    """ A record of the rewrites of a derivation.
+
+    Each step is a pair of a rule name and the canonical encoding of its target:
+
+        * The target of a context-free rule (a node ID) is stored as it is.
+        * The target of the other rules (a dictionary which takes a node ID of the LHS and returns
+          a node ID of the graph or None) is stored as a list of [lhs_node_id, node_id]
+          sorted by lhs_node_id.
+
+    Therefore, a trace can be saved as a JSON file and compared with other traces.
+    A trace is replayed by GraphCompiler.replay_trace on the graph from which it was recorded.
+
+    Attributes:
+        steps(list): The pairs [rule_name, encoded_target].
+        metadata(dict): Any JSON serializable information, such as the seed.
+
+    """
+    format_version = 1
+
+    def __init__(self, steps=None, metadata=None):
+        self.steps = [] if steps is None else [list(step) for step in steps]
+        self.metadata = {} if metadata is None else dict(metadata)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        """ Yields the pairs (rule_name, target) with the decoded targets. """
+        for rule_name, encoded_target in self.steps:
+            yield rule_name, self.decode_target(encoded_target)
+
+    def append(self, rule_name, target):
+        """ Adds a step.
+
+        Args:
+            rule_name(str): The name of the applied rule.
+            target: The target as returned by get_applicable_rule.
+
+        """
+        self.steps.append([rule_name, self.encode_target(target)])
+
+    @classmethod
+    def encode_target(cls, target):
+        """ Returns the canonical encoding of the target. """
+        if isinstance(target, dict):
+            return sorted([lhs_node_id, node_id] for lhs_node_id, node_id in target.items())
+        return target
+
+    @classmethod
+    def decode_target(cls, encoded_target):
+        """ Returns the target encoded by encode_target. """
+        if isinstance(encoded_target, list):
+            return {lhs_node_id: node_id for lhs_node_id, node_id in encoded_target}
+        return encoded_target
+
+    def to_dict(self):
+        """ Returns a JSON serializable dictionary of the trace. """
+        return {'version': self.format_version, 'metadata': self.metadata, 'steps': self.steps}
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Generates a trace from a dictionary returned by to_dict.
+
+        Raises:
+            ValueError: The format version is not supported.
+
+        """
+        if data.get('version') != cls.format_version:
+            raise ValueError("Unsupported trace version: " + str(data.get('version')))
+        return cls(data['steps'], data.get('metadata'))
+
+    def save(self, path):
+        """ Saves the trace as a JSON file. """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a trace saved by save. """
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
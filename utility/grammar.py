@@ -1,7 +1,13 @@
 import xml.etree.ElementTree as ET
-import copy
+import os
+import pickle
+import hashlib
+import tempfile
+import logging
 import itertools
-from functools import reduce
+from structured_log import get_logger, log_event
+
+_logger = get_logger('grammar')
 
 class ColoredException(Exception):
     def __init__(self, arg="", color="\033[31m"):
@@ -1071,9 +1077,11 @@ class SimpleExoticGraph(SimpleGraph):
     
     """
     exotic_class = 'exotic'
+    absent_exotic_allowed = False
     def __init__(self):
         super().__init__()
         self.exotic_nodes = SimpleNodeBundle()
+        self.compiled_pattern = None
 
     def add_exotic_node(self, node_id, label_dict={}):
         """ Adds an exotic node to the exotic_nodes.
@@ -1185,6 +1193,23 @@ class SimpleExoticGraph(SimpleGraph):
         """ Checks if the node with the given node_id is a exotic node. """
         return node_id in self.exotic_nodes
 
+    def compile_pattern(self):
+        """ Compiles the graph into a CompiledPattern object and stores it in compiled_pattern.
+
+        Note:
+            The compiled_pattern is not updated when the graph is modified afterwards.
+            Call this method again after such modifications.
+
+        """
+        self.compiled_pattern = CompiledPattern(self)
+        return self.compiled_pattern
+
+    def get_compiled_pattern(self):
+        """ Returns compiled_pattern. If the graph is not compiled yet, compiles it. """
+        if self.compiled_pattern is None:
+            self.compile_pattern()
+        return self.compiled_pattern
+
     def gen_element(self, exotic_graph_tag, exotic_node_tag, indent_num=0, indent_width=2):
         """ Generates a graph element of GGDL files. 
 
@@ -1266,6 +1291,300 @@ class SimpleExoticGraph(SimpleGraph):
         return graph
     
 
+class CompiledPattern():
+    """ A matching engine precompiled from a SimpleExoticGraph class object.
+
+    The matchings of an anchor graph or a wildcard graph are searched by backtracking
+    over the ordinary nodes in a precompiled order, like the VF2 algorithm.
+    Each node of the pattern is mapped to a node of the target graph adjacent to
+    the image of an already mapped node, and the labels, the degrees and the edges
+    between mapped nodes are checked as soon as the node is mapped.
+    The exotic nodes are assigned only after all the ordinary nodes are mapped.
+
+    The degree of a node of the target graph must be equal to that of the pattern
+    when absent_exotic_allowed of the graph is False (anchor graphs).
+    Otherwise, it must not exceed that of the pattern (wildcard graphs),
+    and None is assigned to the exotic nodes with no corresponding node.
+
+    The engine only uses nodes[node_id], 'in' operator of nodes,
+    in_edges(node_id, data=True) and out_edges(node_id, data=True) of the target graph.
+
+    Attributes:
+        node_ids(tuple): The IDs of the ordinary nodes.
+        node_names(dict): The 'name' label of each ordinary node.
+        edge_labels(dict): The label dictionary of each edge between ordinary nodes,
+                           keyed by (start_node_id, end_node_id).
+        in_degree(dict): The indegree of each ordinary node, counting the edges from exotic nodes.
+        out_degree(dict): The outdegree of each ordinary node, counting the edges to exotic nodes.
+        exotic_in(dict): A tuple of the exotic nodes from which an edge comes to each ordinary node.
+        exotic_out(dict): A tuple of the exotic nodes to which an edge goes from each ordinary node.
+        absent_exotic_allowed(bool): If True, the exotic nodes may have no corresponding node.
+        search_orders(dict): The search order starting from each ordinary node.
+                             See __gen_search_order.
+        default_root(str): The node from which the search starts when no nodes are specified.
+
+    """
+    def __init__(self, exotic_graph):
+        """
+        Args:
+            exotic_graph(SimpleExoticGraph): The graph to be compiled.
+
+        """
+        pattern = exotic_graph.de_exotic()
+
+        self.node_ids = tuple(pattern.nodes)
+        self.node_names = {node_id: pattern.nodes[node_id]['name'] for node_id in self.node_ids}
+        self.edge_labels = {(edge[0], edge[1]): edge[2] for edge in pattern.edges(data=True)}
+        self.in_degree = {}
+        self.out_degree = {}
+        self.exotic_in = {}
+        self.exotic_out = {}
+        for node_id in self.node_ids:
+            in_edges = exotic_graph.in_edges(node_id)
+            out_edges = exotic_graph.out_edges(node_id)
+            self.in_degree[node_id] = len(in_edges)
+            self.out_degree[node_id] = len(out_edges)
+            self.exotic_in[node_id] = tuple(
+                    edge[0] for edge in in_edges if exotic_graph.is_exotic_node(edge[0]))
+            self.exotic_out[node_id] = tuple(
+                    edge[1] for edge in out_edges if exotic_graph.is_exotic_node(edge[1]))
+        self.absent_exotic_allowed = exotic_graph.absent_exotic_allowed
+        self.search_orders = {node_id: self.__gen_search_order(node_id) for node_id in self.node_ids}
+        # The node with the largest degree prunes the search most.
+        self.default_root = max(self.node_ids, 
+                key=lambda node_id: self.in_degree[node_id] + self.out_degree[node_id],
+                default=None)
+
+    def __gen_search_order(self, root):
+        """ Generates the order of the nodes to be mapped, starting from the root.
+
+        The nodes are visited in the breadth first order regarding the edges as undirected ones,
+        so that each node except the root is adjacent to a node visited before.
+        The other connected components follow in the same manner.
+
+        Each element of the returned tuple is a tuple (node_id, parent, direction, checks).
+        'parent' is the node visited before from which the node is reached, or None.
+        'direction' is 'out' if the edge goes from the parent to the node, and 'in' otherwise.
+        'checks' is a tuple of (node_id_before, label_out, label_in) for all the nodes visited before,
+        where label_out (label_in) is the label dictionary of the edge from (to) the node
+        to (from) node_id_before, or None if there is no such an edge.
+
+        Args:
+            root(str): The ID of the node to be mapped first.
+
+        """
+        order = []
+        visited = []
+        for start in (root,) + self.node_ids:
+            if start in visited:
+                continue
+            queue = [(start, None, None)]
+            visited.append(start)
+            while len(queue) != 0:
+                node_id, parent, direction = queue.pop(0)
+                checks = tuple((step[0], 
+                        self.edge_labels.get((node_id, step[0])), 
+                        self.edge_labels.get((step[0], node_id))) for step in order)
+                order.append((node_id, parent, direction, checks))
+                for neighbor in self.node_ids:
+                    if neighbor in visited:
+                        continue
+                    if (node_id, neighbor) in self.edge_labels:
+                        queue.append((neighbor, node_id, 'out'))
+                        visited.append(neighbor)
+                    elif (neighbor, node_id) in self.edge_labels:
+                        queue.append((neighbor, node_id, 'in'))
+                        visited.append(neighbor)
+        return tuple(order)
+
+    def iter_matching(self, target_graph, around=None):
+        """ Yields the matchings of the pattern in the target_graph.
+
+        Each matching is a dictionary which takes the IDs of the nodes (including the exotic nodes)
+        of the pattern and returns the corresponding node IDs of the target_graph.
+
+        Args:
+            target_graph(DiGraph): The target graph.
+            around(set or None): If given, only the matchings which map an ordinary node
+                                 to one of the nodes in around are yielded.
+
+        """
+        if self.default_root is None:
+            return
+        # A cache of (name, in-edges, out-edges) of the nodes of the target_graph.
+        adjacency = {}
+        if around is None:
+            for partial_match in self.__search(target_graph, adjacency, self.default_root, None):
+                yield from self.__assign_exotic_nodes(partial_match, adjacency)
+            return
+
+        # Start the search from each pair of a node in around and an ordinary node with the same name.
+        # A matching containing several nodes in around is found several times, so skip the duplicates.
+        found = set()
+        for seed in around:
+            if seed not in target_graph.nodes:
+                continue
+            seed_name = target_graph.nodes[seed].get('name')
+            for root in self.node_ids:
+                if self.node_names[root] != seed_name:
+                    continue
+                for partial_match in self.__search(target_graph, adjacency, root, seed):
+                    key = tuple(partial_match[node_id] for node_id in self.node_ids)
+                    if key in found:
+                        continue
+                    found.add(key)
+                    yield from self.__assign_exotic_nodes(partial_match, adjacency)
+
+    def __get_adjacency(self, target_graph, adjacency, target_node_id):
+        """ Returns (name, in-edges, out-edges) of the node of the target_graph.
+
+        The in-edges (out-edges) is a dictionary which takes the IDs of the nodes
+        from (to) which an edge comes (goes) and returns the label dictionary of the edge.
+
+        """
+        try:
+            return adjacency[target_node_id]
+        except KeyError:
+            pass
+        entry = (target_graph.nodes[target_node_id].get('name'),
+                {edge[0]: edge[2] for edge in target_graph.in_edges(target_node_id, data=True)},
+                {edge[1]: edge[2] for edge in target_graph.out_edges(target_node_id, data=True)})
+        adjacency[target_node_id] = entry
+        return entry
+
+    def __search(self, target_graph, adjacency, root, seed):
+        """ Yields the mappings of the ordinary nodes to the nodes of the target_graph.
+
+        Args:
+            target_graph(DiGraph): The target graph.
+            adjacency(dict): The cache for __get_adjacency.
+            root(str): The ordinary node to be mapped first.
+            seed(int or None): The node to which the root is mapped.
+                               If None, all the nodes of the target_graph are tried.
+
+        """
+        order = self.search_orders[root]
+        mapping = {}
+        # Iterators over the candidates for each position of the order.
+        stack = [iter((seed,) if seed is not None else list(target_graph.nodes))]
+        while len(stack) != 0:
+            position = len(stack) - 1
+            node_id, parent, direction, checks = order[position]
+            if node_id in mapping:
+                del mapping[node_id]
+            for candidate in stack[-1]:
+                if candidate in mapping.values():
+                    continue
+                if self.__is_feasible(target_graph, adjacency, mapping, order[position], candidate):
+                    mapping[node_id] = candidate
+                    break
+            else:
+                stack.pop()
+                continue
+
+            if position + 1 == len(order):
+                yield dict(mapping)
+                continue
+            next_node_id, next_parent, next_direction, next_checks = order[position + 1]
+            if next_parent is None:
+                stack.append(iter(list(target_graph.nodes)))
+            else:
+                name, in_edges, out_edges = self.__get_adjacency(
+                        target_graph, adjacency, mapping[next_parent])
+                stack.append(iter(out_edges if next_direction == 'out' else in_edges))
+
+    def __is_feasible(self, target_graph, adjacency, mapping, step, candidate):
+        """ Checks if the node of the pattern can be mapped to the candidate.
+
+        Args:
+            target_graph(DiGraph): The target graph.
+            adjacency(dict): The cache for __get_adjacency.
+            mapping(dict): The mapping of the nodes visited before.
+            step(tuple): An element of the search order for the node to be mapped.
+            candidate(int): The ID of the node of the target_graph.
+
+        """
+        node_id, parent, direction, checks = step
+        if target_graph.nodes[candidate].get('name') != self.node_names[node_id]:
+            return False
+        name, in_edges, out_edges = self.__get_adjacency(target_graph, adjacency, candidate)
+        if self.absent_exotic_allowed:
+            if len(in_edges) > self.in_degree[node_id] or len(out_edges) > self.out_degree[node_id]:
+                return False
+        else:
+            if len(in_edges) != self.in_degree[node_id] or len(out_edges) != self.out_degree[node_id]:
+                return False
+        # The matching is induced, so an edge must exist in the target graph
+        # if and only if the corresponding edge exists in the pattern.
+        checks = checks + ((node_id, self.edge_labels.get((node_id, node_id)), None),)
+        for before, label_out, label_in in checks:
+            target_before = mapping.get(before, candidate)
+            if not self.__edge_match(out_edges, target_before, label_out):
+                return False
+            if before != node_id and not self.__edge_match(in_edges, target_before, label_in):
+                return False
+        return True
+
+    @classmethod
+    def __edge_match(cls, edges, target_node_id, label_dict):
+        """ Checks the edge to (from) the target_node_id in the edges corresponds to the label_dict.
+
+        Args:
+            edges(dict): The in-edges or out-edges given by __get_adjacency.
+            target_node_id(int): The ID of the node at the other end of the edge.
+            label_dict(dict or None): The label dictionary of the edge of the pattern.
+                                      None if the pattern has no such an edge.
+
+        """
+        if label_dict is None:
+            return target_node_id not in edges
+        return target_node_id in edges and SimpleGraph.edge_match(edges[target_node_id], label_dict)
+
+    @classmethod
+    def __unique_permutations(cls, candidates, num):
+        """ Returns the permutations of the candidates without duplicates, keeping their order. """
+        return list(dict.fromkeys(itertools.permutations(candidates, num)))
+
+    def __assign_exotic_nodes(self, partial_match, adjacency):
+        """ Yields the matchings made by assigning the exotic nodes to the partial_match.
+
+        Args:
+            partial_match(dict): The mapping of the ordinary nodes.
+            adjacency(dict): The cache for __get_adjacency.
+
+        """
+        matched_nodes = set(partial_match.values())
+        exotic_patterns_of_each_node = []
+        for node_id in self.node_ids:
+            name, in_edges, out_edges = adjacency[partial_match[node_id]]
+            # Nodes which can match with exotic nodes must be chosen from nodes not in the partial match.
+            candidate_in = [n for n in in_edges if n not in matched_nodes]
+            candidate_out = [n for n in out_edges if n not in matched_nodes]
+            exotic_in = list(self.exotic_in[node_id])
+            exotic_out = list(self.exotic_out[node_id])
+            if self.absent_exotic_allowed:
+                candidate_in = candidate_in + [None] * (len(exotic_in) - len(candidate_in))
+                candidate_out = candidate_out + [None] * (len(exotic_out) - len(candidate_out))
+
+            exotic_patterns = []
+            for pattern_in in self.__unique_permutations(candidate_in, len(exotic_in)):
+                for pattern_out in self.__unique_permutations(candidate_out, len(exotic_out)):
+                    added_pattern = dict(zip(exotic_in + exotic_out, pattern_in + pattern_out))
+                    # More than two exotic nodes must not match with a single node.
+                    assigned = [v for v in added_pattern.values() if v is not None]
+                    if len(assigned) == len(set(assigned)):
+                        exotic_patterns.append(added_pattern)
+            if len(exotic_patterns) == 0:
+                return
+            exotic_patterns_of_each_node.append(exotic_patterns)
+
+        for exotic_pattern_of_nodes in itertools.product(*exotic_patterns_of_each_node):
+            match = dict(partial_match)
+            for exotic_pattern in exotic_pattern_of_nodes:
+                match.update(exotic_pattern)
+            yield match
+
+
 class SimpleAnchorGraph(SimpleExoticGraph):
     """ A class for graphs with anchor nodes.
 
@@ -1368,88 +1687,26 @@ class SimpleAnchorGraph(SimpleExoticGraph):
             return False
         return True
 
-    def find_matching(self, target_graph):
-        """ Fully overrides the find_matching method of the SimpleGraph class. """
-        pattern = self.de_anchor()
-        #print("pattern node = " + str(pattern.nodes(data=True)))
-        #print("pattern edge = " + str(pattern.edges()))
-        # The partial_matches below cares only the labels of nodes and edges.
-        partial_matches = pattern.find_subgraph_labelled_morphism(target_graph)
-        #print("partial_matches = " + str(partial_matches))
-        matches = []
-
-        # Discard matches which contain a node which has exceeding degree.
-        for i in range(len(partial_matches)):
-            pm = partial_matches[i]
-            anchor_patterns_of_each_node = {}
-            is_invalid_pm = False
-            # print("pm = " + str(pm))
-            for instance_node_id in pm:
-                pattern_in_edges = self.in_edges(instance_node_id)
-                pattern_out_edges = self.out_edges(instance_node_id)
-
-                target_node_id = pm[instance_node_id]
-                target_in_edges = target_graph.in_edges(target_node_id)
-                target_out_edges = target_graph.out_edges(target_node_id)
-                #print("target_in_edges = " + str(target_in_edges))
-                #print("target_out_edges = " + str(target_out_edges))
-
-                if len(target_in_edges) != len(pattern_in_edges):
-                    is_invalid_pm = True
-                    break
-                if len(target_out_edges) != len(pattern_out_edges):
-                    is_invalid_pm = True
-                    break
+    def find_matching(self, target_graph, around=None):
+        """ Fully overrides the find_matching method of the SimpleGraph class.
 
-                # check out possible anchor patterns
-                # Get nodes which can match with anchors.
-                # Those nodes must be chosen from nodes not in the partial match.
-                anchor_candidate_in = [edge[0] for edge in target_in_edges if edge[0] not in pm.values()]
-                anchor_candidate_out = [edge[1] for edge in target_out_edges if edge[1] not in pm.values()]
-                #print("anchor_candidate_in = " + str(anchor_candidate_in))
-                #print("anchor_candidate_out = " + str(anchor_candidate_out))
-
-                anchor_in = [edge[0] for edge in pattern_in_edges if self.is_anchor_node(edge[0])]
-                anchor_out = [edge[1] for edge in pattern_out_edges if self.is_anchor_node(edge[1])]
-                #print("anchor_in = " + str(anchor_in))
-                #print("anchor_out = " + str(anchor_out))
-
-                anchor_num_in = len(anchor_in)
-                anchor_num_out = len(anchor_out)
-
-                # Check out all the permutation patterns of the anchors.
-                patterns_in = set(itertools.permutations(anchor_candidate_in, anchor_num_in))
-                patterns_out = set(itertools.permutations(anchor_candidate_out, anchor_num_out))
-
-                # Save the patterns in the same format with pm.
-                # i.e. a dictionary which takes node_ids of the exotic_nodes (anchors) of self
-                #      and returns the corresponding node ids of the target_graph.
-                anchor_pattern = []
-                for pattern_in in patterns_in:
-                    for pattern_out in patterns_out:
-                        added_pattern = dict(zip(anchor_in + anchor_out, pattern_in + pattern_out))
-                        non_none_anchors = {k:v for k, v in added_pattern.items() if v is not None}
-                        # Note: In the added_pattern, more than two anchors can matches with a single node.
-                        # e.g. {'-1':1, '-2':1, ... } ('-1', and '-2' are the ids for the anchors.)
-                        # Such the cases are not acceptable, therefore reject such the patterns.
-                        if len(set(non_none_anchors.keys())) == len(set(non_none_anchors.values())):
-                                anchor_pattern.append(added_pattern)
-
-                anchor_patterns_of_each_node[instance_node_id] = anchor_pattern
-
-            if is_invalid_pm:
-                continue
-            # The validity of all the nodes is confirmed, and all the anchor patterns are collected.
+        Args:
+            target_graph(DiGraph): The target graph.
+            around(set or None): If given, only the matchings which map a node of the instance
+                                 (not an anchor) to one of the nodes in around are returned.
 
-            # Concatenate the partial match with a anchor pattern
-            # and add it into the matches.
-            for anchor_pattern_of_nodes in itertools.product(*anchor_patterns_of_each_node.values()):
-                # anchor_pattern_of_all_nodes is a tuple of dictionaries.
-                copied_pm = copy.deepcopy(pm)
-                matches.append(reduce(lambda d1, d2: {**d1, **d2}, anchor_pattern_of_nodes, pm))
+        """
+        return list(self.iter_matching(target_graph, around))
 
-        return matches
+    def iter_matching(self, target_graph, around=None):
+        """ Works as find_matching, but yields the matchings one by one.
 
+        Args:
+            target_graph(DiGraph): The target graph.
+            around(set or None): See find_matching.
+
+        """
+        return self.get_compiled_pattern().iter_matching(target_graph, around)
 
 
     @classmethod
@@ -1474,6 +1731,7 @@ class SimpleWildcardGraph(SimpleExoticGraph):
 
     """
     exotic_class = 'wildcard'
+    absent_exotic_allowed = True
 
     def add_edge_by_simple_edge(self, edge, ignore_existence_of_node=False):
         """ Method override.
@@ -1522,95 +1780,27 @@ class SimpleWildcardGraph(SimpleExoticGraph):
         """ Checks the node in the matching candidate meets additional criteria."""
         return True
     
-    def find_matching(self, target_graph):
-        """ Fully overrides the find_matching method of the SimpleGraph class. """
-        pattern = self.de_wildcard()
-        #print("pattern node = " + str(pattern.nodes(data=True)))
-        #print("pattern edge = " + str(pattern.edges()))
-        # The partial_matches below cares only the labels of nodes and edges.
-        partial_matches = pattern.find_subgraph_labelled_morphism(target_graph)
-        #print("partial_matches = " + str(partial_matches))
-        matches = []
-
-        # Discard matches which contain a node which has exceeding degree.
-        for i in range(len(partial_matches)):
-            pm = partial_matches[i]
-            wildcard_patterns_of_each_node = {}
-            is_invalid_pm = False
-            # print("pm = " + str(pm))
-            for instance_node_id in pm:
-                pattern_in_edges = self.in_edges(instance_node_id)
-                pattern_out_edges = self.out_edges(instance_node_id)
-
-                target_node_id = pm[instance_node_id]
-                target_in_edges = target_graph.in_edges(target_node_id)
-                target_out_edges = target_graph.out_edges(target_node_id)
-                #print("target_in_edges = " + str(target_in_edges))
-                #print("target_out_edges = " + str(target_out_edges))
-
-                if len(target_in_edges) > len(pattern_in_edges):
-                    is_invalid_pm = True
-                    break
-                if len(target_out_edges) > len(pattern_out_edges):
-                    is_invalid_pm = True
-                    break
+    def find_matching(self, target_graph, around=None):
+        """ Fully overrides the find_matching method of the SimpleGraph class.
 
-                # check out possible wildcard patterns
-                # Get nodes which can match with wildcards.
-                # Those nodes must be chosen from nodes not in the partial match.
-                wildcard_candidate_in = [edge[0] for edge in target_in_edges if edge[0] not in pm.values()]
-                wildcard_candidate_out = [edge[1] for edge in target_out_edges if edge[1] not in pm.values()]
-                #print("wildcard_candidate_in = " + str(wildcard_candidate_in))
-                #print("wildcard_candidate_out = " + str(wildcard_candidate_out))
-
-                wildcard_in = [edge[0] for edge in pattern_in_edges if self.is_wildcard_node(edge[0])]
-                wildcard_out = [edge[1] for edge in pattern_out_edges if self.is_wildcard_node(edge[1])]
-                #print("wildcard_in = " + str(wildcard_in))
-                #print("wildcard_out = " + str(wildcard_out))
-
-                wildcard_num_in = len(wildcard_in)
-                wildcard_num_out = len(wildcard_out)
-                num_of_absent_nodes_in = wildcard_num_in - len(wildcard_candidate_in)
-                num_of_absent_nodes_out = wildcard_num_out - len(wildcard_candidate_out)
-
-                # Fullfill candidate lists with None
-                wildcard_candidate_in = wildcard_candidate_in + [None] * num_of_absent_nodes_in
-                wildcard_candidate_out = wildcard_candidate_out + [None] * num_of_absent_nodes_out
-                #print("wildcard_candidate_in = " + str(wildcard_candidate_in))
-                #print("wildcard_candidate_out = " + str(wildcard_candidate_out))
-
-                # Check out all the permutation patterns of the wildcards.
-                patterns_in = set(itertools.permutations(wildcard_candidate_in, wildcard_num_in))
-                patterns_out = set(itertools.permutations(wildcard_candidate_out, wildcard_num_out))
-
-                # Save the patterns in the same format with pm.
-                # i.e. a dictionary which takes node_ids of the exotic_nodes (wildcards) of self
-                #      and returns the corresponding node ids of the target_graph.
-                wildcard_pattern = []
-                for pattern_in in patterns_in:
-                    for pattern_out in patterns_out:
-                        added_pattern = dict(zip(wildcard_in + wildcard_out, pattern_in + pattern_out))
-                        non_none_wildcards = {k:v for k, v in added_pattern.items() if v is not None}
-                        # Note: In the added_pattern, more than two wildcards can matches with a single node.
-                        # e.g. {'-1':1, '-2':1, ... } ('-1', and '-2' are the ids for the wildcards.)
-                        # Such the cases are not acceptable, therefore reject such the patterns.
-                        if len(set(non_none_wildcards.keys())) == len(set(non_none_wildcards.values())):
-                                wildcard_pattern.append(added_pattern)
-
-                wildcard_patterns_of_each_node[instance_node_id] = wildcard_pattern
-
-            if is_invalid_pm:
-                continue
-            # The validity of all the nodes is confirmed, and all the wildcard patterns are collected.
+        Args:
+            target_graph(DiGraph): The target graph.
+            around(set or None): If given, only the matchings which map a node of the instance
+                                 (not a wildcard) to one of the nodes in around are returned.
+
+        """
+        return list(self.iter_matching(target_graph, around))
 
-            # Concatenate the partial match with a wildcard pattern
-            # and add it into the matches.
-            for wildcard_pattern_of_nodes in itertools.product(*wildcard_patterns_of_each_node.values()):
-                # wildcard_pattern_of_all_nodes is a tuple of dictionaries.
-                copied_pm = copy.deepcopy(pm)
-                matches.append(reduce(lambda d1, d2: {**d1, **d2}, wildcard_pattern_of_nodes, pm))
+    def iter_matching(self, target_graph, around=None):
+        """ Works as find_matching, but yields the matchings one by one.
+
+        Args:
+            target_graph(DiGraph): The target graph.
+            around(set or None): See find_matching.
+
+        """
+        return self.get_compiled_pattern().iter_matching(target_graph, around)
 
-        return matches
 
     @classmethod
     def parse_graph_element(cls, graph_element, optional_wildcard_nodes=None):
@@ -1625,6 +1815,44 @@ class SimpleWildcardGraph(SimpleExoticGraph):
 
 
 
+class RhsTemplate():
+    """ The nodes and the edges of a RHS lowered into the form passed to add_nodes_from and add_edges_from.
+
+    Reading the nodes and the edges of a SimpleGraph builds new lists of tuples every time.
+    A template reads them once, so that a rewrite only maps the IDs of the RHS to the new IDs.
+    The label dictionaries are shared by all the rewrites.
+    This is safe because networkx and CompactDiGraph copy the labels when nodes and edges are added.
+
+    Attributes:
+        node_ids(tuple): The IDs of the nodes of the RHS (excluding the exotic nodes) in the order of insertion.
+        nodes(tuple): Pairs (node_id, label_dict) of the nodes of the RHS.
+        edges(tuple): Triples (start_node_id, end_node_id, label_dict) of the edges of the RHS,
+                      including the ones connecting with the exotic nodes.
+
+    """
+    def __init__(self, rhs):
+        self.nodes = tuple((node_id, dict(label_dict)) for node_id, label_dict in rhs.nodes(data=True))
+        self.node_ids = tuple(node_id for node_id, label_dict in self.nodes)
+        self.edges = tuple((start, end, dict(label_dict)) for start, end, label_dict in rhs.edges(data=True))
+
+    def lower(self, morphism):
+        """ Returns the nodes and the edges with the IDs of the target graph.
+
+        Args:
+            morphism(dict): A dictionary which takes an ID of the RHS and returns an ID of the target graph.
+                            The edges connecting with the nodes absent from the morphism are omitted.
+
+        Returns:
+            tuple: (nodes, edges). The lists to be passed to add_nodes_from and add_edges_from.
+
+        """
+        nodes = [(morphism[node_id], label_dict) for node_id, label_dict in self.nodes]
+        edges = [(morphism[start], morphism[end], label_dict) 
+                for start, end, label_dict in self.edges
+                if start in morphism and end in morphism]
+        return nodes, edges
+
+
 class BaseRule():
     """ A base class for rules of graph grammar. 
     
@@ -1658,6 +1886,7 @@ class BaseRule():
         self.name = name
         self.lhs = lhs
         self.rhs = rhs
+        self.rhs_template = None
         self._check_lhs_format()
         self._check_rhs_format()
 
@@ -1689,6 +1918,21 @@ class BaseRule():
     def get_rhs_nodes(self):
         return self.rhs.nodes.get_nodes()
 
+    def compile(self):
+        """ Precomputes the data reused in every matching query and every rewrite.
+
+        GGDLParser calls this method once the rule is loaded.
+        Inheritance classes extend this method if they have such data.
+
+        """
+        self.rhs_template = RhsTemplate(self.rhs)
+
+    def get_rhs_template(self):
+        """ Returns the RhsTemplate of the RHS. If the rule is not compiled yet, generates it. """
+        if self.rhs_template is None:
+            self.rhs_template = RhsTemplate(self.rhs)
+        return self.rhs_template
+
     def gen_element_list(self, indent_num=0, indent_width=2):
         """ Generates a list of strings for element generation. """
         temp1 = ' '*indent_width*indent_num + '<rule name="' + self.name + '">'
@@ -1698,8 +1942,18 @@ class BaseRule():
     def get_target_subgraph(self, target_graph):
         """ Returns a list of morphisms to subgraphs to which the rule is applicable.
 
+        Args:
+            target_graph(DiGraph): A graph searched for subgraphs.
+
+        """
+        return list(self.iter_target_subgraph(target_graph))
+
+    def iter_target_subgraph(self, target_graph):
+        """ Yields morphisms to subgraphs to which the rule is applicable.
+
         Note:
             This method needs to be overrided from inheritance classes.
+            The target_graph must not be modified until the iteration finishes.
 
         Args:
             target_graph(DiGraph): A graph searched for subgraphs.
@@ -1707,14 +1961,101 @@ class BaseRule():
         """
         raise ColoredException("This method should not be called.")
 
-    def apply_rule(self, morphism, target_graph):
-        """ Applys the rule to the subgraph of the target_graph specified with the codomain of the morphism.
+    def is_applicable(self, target_graph, node_ids=None):
+        """ Checks if the rule has a target, stopping the search at the first target found.
+
+        Args:
+            target_graph(DiGraph): A graph searched for subgraphs.
+            node_ids(iterable or None): If given, only the targets which replace one of the nodes 
+                                        are searched for. See get_target_subgraph_around.
+
+        """
+        if node_ids is None:
+            targets = self.iter_target_subgraph(target_graph)
+        else:
+            targets = self.iter_target_subgraph_around(target_graph, node_ids)
+        for target in targets:
+            return True
+        return False
+
+    def iter_target_subgraph_around(self, target_graph, node_ids):
+        """ Yields the targets of get_target_subgraph_around one by one.
+
+        Inheritance classes override this method if they can search lazily.
+
+        """
+        return iter(self.get_target_subgraph_around(target_graph, node_ids))
+
+    def get_target_subgraph_around(self, target_graph, node_ids):
+        """ Returns a list of morphisms to subgraphs which contain one of the given nodes.
+
+        Only the nodes replaced by the rule are considered.
+        i.e. A morphism which maps only anchors or wildcards to the given nodes is not returned.
 
         Note:
             This method needs to be overrided from inheritance classes.
 
         Args:
             target_graph(DiGraph): A graph searched for subgraphs.
+            node_ids(set): IDs of the nodes of the target_graph.
+
+        """
+        raise ColoredException("This method should not be called.")
+
+    def get_replaced_symbols(self):
+        """ Returns a set of the symbols of the nodes to be replaced by the rule.
+
+        A target of the rule always maps a node with one of these symbols to a replaced node.
+
+        Note:
+            This method needs to be overrided from inheritance classes.
+
+        """
+        raise ColoredException("This method should not be called.")
+
+    def get_target_nodes(self, target):
+        """ Returns a set of IDs of the nodes to be replaced when the rule applies to the target.
+
+        Note:
+            This method needs to be overrided from inheritance classes.
+
+        Args:
+            target: One of the elements returned from get_target_subgraph.
+
+        """
+        raise ColoredException("This method should not be called.")
+
+    def apply_rule(self, morphism, target_graph, id_generator):
+        """ Applys the rule to the subgraph of the target_graph specified with the codomain of the morphism.
+
+        Note:
+            This method modifies the target_graph.
+            The nodes and the edges of lower_rule are added, and then the nodes are removed.
+
+        Args:
+            morphism: See lower_rule of the inheritance classes.
+            target_graph(DiGraph): A graph searched for subgraphs.
+            id_generator(function): See lower_rule of the inheritance classes.
+
+        """
+        removed_nodes, nodes, edges = self.lower_rule(morphism, target_graph, id_generator)
+        target_graph.add_nodes_from(nodes)
+        target_graph.add_edges_from(edges)
+        target_graph.remove_nodes_from(removed_nodes)
+
+    def lower_rule(self, morphism, target_graph, id_generator):
+        """ Returns the changes of the target_graph made by applying the rule, without modifying it.
+
+        Note:
+            This method needs to be overrided from inheritance classes.
+
+        Returns:
+            tuple: (removed_nodes, nodes, edges)
+                removed_nodes(list): IDs of the nodes to be removed.
+                nodes(list): Pairs (node_id, label_dict) to be passed to add_nodes_from.
+                edges(list): Triples (start_node_id, end_node_id, label_dict) to be passed to add_edges_from.
+                             They may connect with the nodes to be removed,
+                             which are removed after the edges are added.
 
         """
         raise ColoredException("This method should not be called.")
@@ -1817,6 +2158,14 @@ class ContextFreeRule(BaseRule):
     def get_lhs_nodes(self):
         return [self.lhs]
 
+    def get_replaced_symbol(self):
+        """ Returns the symbol of the LHS. """
+        return self.lhs['name']
+
+    def get_replaced_symbols(self):
+        """ Returns a set containing the symbol of the LHS. """
+        return {self.get_replaced_symbol()}
+
     def gen_element(self, indent_num=0, indent_width=2):
         """ Generates a node element of GGDL file.
 
@@ -1839,33 +2188,50 @@ class ContextFreeRule(BaseRule):
         return '\n'.join(str_list)
 
  
-    def get_target_subgraph(self, target_graph):
-        """ Returns a list of morphisms to subgraphs to which the rule is applicable.
+    def iter_target_subgraph(self, target_graph):
+        """ Yields morphisms to subgraphs to which the rule is applicable.
 
         Args:
             target_graph(DiGraph): A graph searched for subgraphs.
 
-        Returns:
-            list: Each element is a node id of the target graph.
-                  The node specified with the id have the 'name' attribute of which
-                  the value is same as the one of the LHS.
+        Yields:
+            Each element is a node id of the target graph.
+            The node specified with the id have the 'name' attribute of which
+            the value is same as the one of the LHS.
 
         """
-        ret = []
         for node_id in target_graph.nodes:
             try:
                 if target_graph.nodes[node_id]['name'] == self['LHS']['name']:
-                    ret.append(node_id)
+                    yield node_id
             except KeyError:
                 pass
-        return ret
 
+    def get_target_subgraph_around(self, target_graph, node_ids):
+        """ Returns a list of IDs of the given nodes to which the rule is applicable.
 
-    def apply_rule(self, target_node_id, target_graph, id_generator):
-        """ Applys the rule to the subgraph of the target_graph specified with the codomain of the morphism.
+        Args:
+            target_graph(DiGraph): A graph searched for subgraphs.
+            node_ids(set): IDs of the nodes of the target_graph.
 
-        Note:
-            This method modifies the target_graph.
+        """
+        return list(self.iter_target_subgraph_around(target_graph, node_ids))
+
+    def iter_target_subgraph_around(self, target_graph, node_ids):
+        """ Yields the IDs of get_target_subgraph_around one by one. """
+        for node_id in node_ids:
+            try:
+                if target_graph.nodes[node_id]['name'] == self['LHS']['name']:
+                    yield node_id
+            except KeyError:
+                pass
+
+    def get_target_nodes(self, target):
+        """ Returns a set containing the target node ID. """
+        return {target}
+
+    def lower_rule(self, target_node_id, target_graph, id_generator):
+        """ Returns the changes of the target_graph made by replacing the node. See BaseRule.lower_rule.
 
         Args:
             target_node_id: The id for a node to be replaced.
@@ -1875,25 +2241,18 @@ class ContextFreeRule(BaseRule):
                                     and the id_generator returns different ids for all the passed ids.
 
         """
-        # Remember the nodes connecting with the target node.
-        in_edges =  target_graph.in_edges(target_node_id, data=True)
-        out_edges = target_graph.out_edges(target_node_id, data=True)
-        
         # Generates a label changer.
         # That corresponds to choosing a graph to be inserted into the target_graph.
-        morphism = {node_id:id_generator(node_id) for node_id in self['RHS'].nodes}
-        target_graph.add_nodes_from(
-                [(morphism[p[0]], p[1]) for p in self['RHS'].nodes(data=True)])
-        target_graph.add_edges_from(
-                [(morphism[p[0]], morphism[p[1]], p[2]) for p in self['RHS'].edges(data=True)])
-
-        for edge in in_edges:
-            target_graph.add_edge(edge[0], morphism['base'], **edge[2])
-
-        for edge in out_edges:
-            target_graph.add_edge(morphism['base'], edge[1], **edge[2])
-        
-        target_graph.remove_node(target_node_id)
+        template = self.get_rhs_template()
+        morphism = {node_id:id_generator(node_id) for node_id in template.node_ids}
+        nodes, edges = template.lower(morphism)
+
+        # Reconnect the edges of the target node to the base node,
+        # and add them together with the edges of the RHS.
+        base = morphism['base']
+        edges.extend([(edge[0], base, edge[2]) for edge in target_graph.in_edges(target_node_id, data=True)])
+        edges.extend([(base, edge[1], edge[2]) for edge in target_graph.out_edges(target_node_id, data=True)])
+        return [target_node_id], nodes, edges
        
         
     @classmethod
@@ -1963,24 +2322,47 @@ class AnchorRule(BaseRule):
                 indent_width=indent_width))
         return '\n'.join(str_list)
         
-    def get_target_subgraph(self, target_graph):
-        """ Returns a list of morphisms to subgraphs to which the rule is applicable.
+    def iter_target_subgraph(self, target_graph):
+        """ Yields morphisms to subgraphs to which the rule is applicable.
 
         Args:
             target_graph(DiGraph): A graph searched for subgraphs.
 
-        Returns:
-            list: Each element is a morphism from the LHS to a subgraph.
+        Yields:
+            Each element is a morphism from the LHS to a subgraph.
 
         """
-        return self['LHS'].find_matching(target_graph)
+        return self['LHS'].iter_matching(target_graph)
 
+    def get_target_subgraph_around(self, target_graph, node_ids):
+        """ Returns a list of morphisms to subgraphs which contain one of the given nodes.
 
-    def apply_rule(self, morphism, target_graph, id_generator):
-        """ Applys the rule to the subgraph of the target_graph specified with the codomain of the morphism.
+        Args:
+            target_graph(DiGraph): A graph searched for subgraphs.
+            node_ids(set): IDs of the nodes of the target_graph.
 
-        Note:
-            This method modifies the target_graph.
+        """
+        return self['LHS'].find_matching(target_graph, around=node_ids)
+
+    def iter_target_subgraph_around(self, target_graph, node_ids):
+        """ Yields the morphisms of get_target_subgraph_around one by one. """
+        return self['LHS'].iter_matching(target_graph, around=node_ids)
+
+    def compile(self):
+        """ Compiles the LHS pattern and the RHS template. """
+        super().compile()
+        self['LHS'].compile_pattern()
+
+    def get_replaced_symbols(self):
+        """ Returns a set of the symbols of the non-anchor nodes of the LHS. """
+        return {self['LHS'].nodes[node_id]['name'] for node_id in self['LHS'].nodes}
+
+    def get_target_nodes(self, target):
+        """ Returns a set of IDs of the nodes corresponding to the non-anchor nodes of the LHS. """
+        return {target[node_id] for node_id in self['LHS'].nodes}
+
+    def lower_rule(self, morphism, target_graph, id_generator):
+        """ Returns the changes of the target_graph made by rewriting the subgraph. See BaseRule.lower_rule.
 
         Args:
             morphism(dict): A morphism from the LHS to a subgraph.
@@ -1994,17 +2376,14 @@ class AnchorRule(BaseRule):
         
         # Generates a label changer.
         # That corresponds to choosing a graph to be inserted into the target_graph.
-        morphism_to_new = {node_id:id_generator(node_id) for node_id in self['RHS'].nodes}
+        template = self.get_rhs_template()
+        morphism_to_new = {node_id:id_generator(node_id) for node_id in template.node_ids}
         for anchor_node_id in self['LHS'].get_anchor_nodes():
             morphism_to_new[anchor_node_id] = morphism[anchor_node_id]
-
-        target_graph.add_nodes_from(
-                [(morphism_to_new[p[0]], p[1]) for p in self['RHS'].nodes(data=True)])
-        target_graph.add_edges_from(
-                [(morphism_to_new[p[0]], morphism_to_new[p[1]], p[2]) for p in self['RHS'].edges(data=True)])
+        nodes, edges = template.lower(morphism_to_new)
 
         # Remove the nodes corresponding the ones of the LHS except for the ones corresponding the anchor nodes.
-        target_graph.remove_nodes_from([morphism[node_id] for node_id in self['LHS'].nodes])
+        return [morphism[node_id] for node_id in self['LHS'].nodes], nodes, edges
         
     @classmethod
     def parse_rule_element(cls, rule_element):
@@ -2078,25 +2457,49 @@ class WildcardRule(BaseRule):
                 indent_width=indent_width))
         return '\n'.join(str_list)
 
-    def get_target_subgraph(self, target_graph):
-        """ Returns a list of morphisms to subgraphs to which the rule is applicable.
+    def iter_target_subgraph(self, target_graph):
+        """ Yields morphisms to subgraphs to which the rule is applicable.
 
         Args:
             target_graph(DiGraph): A graph searched for subgraphs.
 
-        Returns:
-            list: Each element is a morphism from the LHS to a subgraph.
+        Yields:
+            Each element is a morphism from the LHS to a subgraph.
 
         """
         #print("NAME : " + self['name'])
-        return self['LHS'].find_matching(target_graph)
+        return self['LHS'].iter_matching(target_graph)
 
+    def get_target_subgraph_around(self, target_graph, node_ids):
+        """ Returns a list of morphisms to subgraphs which contain one of the given nodes.
 
-    def apply_rule(self, morphism, target_graph, id_generator):
-        """ Applys the rule to the subgraph of the target_graph specified with the codomain of the morphism.
+        Args:
+            target_graph(DiGraph): A graph searched for subgraphs.
+            node_ids(set): IDs of the nodes of the target_graph.
 
-        Note:
-            This method modifies the target_graph.
+        """
+        return self['LHS'].find_matching(target_graph, around=node_ids)
+
+    def iter_target_subgraph_around(self, target_graph, node_ids):
+        """ Yields the morphisms of get_target_subgraph_around one by one. """
+        return self['LHS'].iter_matching(target_graph, around=node_ids)
+
+    def compile(self):
+        """ Compiles the LHS pattern and the RHS template. """
+        super().compile()
+        self['LHS'].compile_pattern()
+
+    def get_replaced_symbols(self):
+        """ Returns a set of the symbols of the non-wildcard nodes of the LHS. """
+        return {self['LHS'].nodes[node_id]['name'] for node_id in self['LHS'].nodes}
+
+    def get_target_nodes(self, target):
+        """ Returns a set of IDs of the nodes corresponding to the non-wildcard nodes of the LHS. """
+        return {target[node_id] for node_id in self['LHS'].nodes}
+
+
+    def lower_rule(self, morphism, target_graph, id_generator):
+        """ Returns the changes of the target_graph made by rewriting the subgraph. See BaseRule.lower_rule.
 
         Args:
             morphism(dict): A morphism from the LHS to a subgraph.
@@ -2110,21 +2513,17 @@ class WildcardRule(BaseRule):
         
         # Generates a label changer.
         # That corresponds to choosing a graph to be inserted into the target_graph.
-        morphism_to_new = {node_id:id_generator(node_id) for node_id in self['RHS'].nodes}
+        template = self.get_rhs_template()
+        morphism_to_new = {node_id:id_generator(node_id) for node_id in template.node_ids}
         for wildcard_node_id in self['LHS'].get_wildcard_nodes():
             if morphism[wildcard_node_id] is not None:
                 morphism_to_new[wildcard_node_id] = morphism[wildcard_node_id]
-
-        target_graph.add_nodes_from(
-                [(morphism_to_new[p[0]], p[1]) for p in self['RHS'].nodes(data=True)])
-        target_graph.add_edges_from(
-                [(morphism_to_new[p[0]], morphism_to_new[p[1]], p[2]) 
-                    for p in self['RHS'].edges(data=True)
-                    if (p[0] in morphism_to_new) and (p[1] in morphism_to_new)])
+        # The edges connecting with the absent wildcard nodes are not added.
+        nodes, edges = template.lower(morphism_to_new)
 
         # Remove the nodes corresponding the ones of the LHS 
         # except for the ones corresponding the wildcard nodes.
-        target_graph.remove_nodes_from([morphism[node_id] for node_id in self['LHS'].nodes])
+        return [morphism[node_id] for node_id in self['LHS'].nodes], nodes, edges
         
     @classmethod
     def parse_rule_element(cls, rule_element):
@@ -2244,11 +2643,24 @@ class GGDLParser():
         * [2] Guo et al. (2022) "Data-efficient graph grammar learning for molecular generation",
           arXiv preprint arXiv:2203.08031.
 
+    [Cache]
+        Parsing a grammar file, validating the vocabulary and compiling the rules take time.
+        When cache_dir is given, the parsed grammar is pickled into the directory,
+        and loaded directly from the next time.
+        The cache file is named after the SHA-256 hash of the content of the grammar file,
+        the acceptable rule classes and cache_format_version.
+        Thus, a modified grammar file never hits a stale cache.
+        Increment cache_format_version when the pickled classes are changed incompatibly.
+        Since a pickle can execute arbitrary code, use only a trusted directory as cache_dir.
+
     """
+    cache_format_version = 2
+
     def __init__(self, 
             path=None, 
             acceptable_rule_classes=[ContextFreeRule, AnchorRule, WildcardRule],
-            show_content=False):
+            show_content=False,
+            cache_dir=None):
         self.start_graph = None
         self.terminal_symbol_set = {""} # The empty string is always regarded as the terminal symbol.
         self.non_terminal_symbol_set = set()
@@ -2256,15 +2668,30 @@ class GGDLParser():
         self.acceptable_rule_classes = acceptable_rule_classes
 
         if path is not None:
-            self.load_grammar(path, show_content)
+            self.load_grammar(path, show_content, cache_dir)
 
-    def load_grammar(self, path, show_content=True):
+    def load_grammar(self, path, show_content=True, cache_dir=None):
         """ Loads a grammar file and sets members. 
+
+        The cache is used only when nothing is loaded into the instance yet,
+        since the validity of a grammar depends on the symbols loaded before.
         
         Args:
             path(str): A relative path to a grammar file to be loaded.
+            show_content(bool, optional): If True, the content of the grammar is printed.
+            cache_dir(str or None): A directory for the cache of the parsed grammar.
+                                    If None, the cache is not used.
         
         """
+        cache_path = None
+        if cache_dir is not None and self.__is_empty():
+            cache_path = self.__get_cache_path(path, cache_dir)
+            if self.__load_cache(cache_path):
+                self.__print("LOAD GRAMMAR @ " + path + " (CACHE: " + cache_path + ")", show_content)
+                log_event(_logger, logging.INFO, 'grammar_loaded', 
+                        path=path, cache=cache_path, rules=len(self.rules.rule_dict))
+                return
+
         self.__print("LOAD GRAMMAR @ " + path, show_content)
         tree = ET.parse(path)
         root = tree.getroot()
@@ -2312,12 +2739,71 @@ class GGDLParser():
                         if not self.is_vocabulary(node['name']):
                             raise ColoredException('The symbol ( ' + node['name'] + \
                                     ' ) is not in the vocabulary.')
+                    rule.compile()
                     self.rules.add_rule(rule)
                     temp_checker = True
                     break
             if not temp_checker:
                 raise ColoredException("Unsupported rule is detected.")
+        if cache_path is not None:
+            self.__save_cache(cache_path)
         self.__print("LOAD GRAMMAR DONE", show_content)
+        log_event(_logger, logging.INFO, 'grammar_loaded', path=path, cache=None, rules=len(self.rules.rule_dict))
+
+    def __is_empty(self):
+        """ Checks if nothing is loaded into the instance. """
+        return self.start_graph is None and self.terminal_symbol_set == {""} and \
+                len(self.non_terminal_symbol_set) == 0 and len(self.rules.rule_dict) == 0
+
+    def __get_cache_path(self, path, cache_dir):
+        """ Returns the path to the cache file for the grammar file at the path. """
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            h.update(f.read())
+        h.update(('\n' + str(self.cache_format_version)).encode('utf-8'))
+        for rule_class in self.acceptable_rule_classes:
+            h.update(('\n' + rule_class.__module__ + '.' + rule_class.__qualname__).encode('utf-8'))
+        return os.path.join(cache_dir, h.hexdigest() + '.ggdl.pickle')
+
+    def __load_cache(self, cache_path):
+        """ Sets members from the cache file. Returns False if the cache is absent or unusable. """
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            # An absent, broken or incompatible cache is simply rebuilt.
+            return False
+        if not isinstance(cache, dict) or cache.get('version') != self.cache_format_version:
+            return False
+        self.start_graph = cache['start_graph']
+        self.terminal_symbol_set = cache['terminal_symbol_set']
+        self.non_terminal_symbol_set = cache['non_terminal_symbol_set']
+        self.rules = cache['rules']
+        return True
+
+    def __save_cache(self, cache_path):
+        """ Writes members into the cache file. 
+
+        The file is written into a temporary file and renamed,
+        so that other processes never read a partially written cache.
+
+        """
+        cache = {
+                'version': self.cache_format_version,
+                'start_graph': self.start_graph,
+                'terminal_symbol_set': self.terminal_symbol_set,
+                'non_terminal_symbol_set': self.non_terminal_symbol_set,
+                'rules': self.rules}
+        cache_dir = os.path.dirname(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
 
     def save_grammar(self, filename, indent_width=2):
         """ Create a grammar file from an instance.
@@ -1,9 +1,62 @@
 """ GraphCompiler """
 
+import os
 import copy
+import time
+import random
+import functools
+import collections
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 import networkx as nx
 from networkx.algorithms.isomorphism.vf2userfunc import DiGraphMatcher
-from grammar import GGDLParser
+from grammar import GGDLParser, ContextFreeRule
+from id_allocator import IdAllocator
+from derivation_trace import DerivationTrace
+
+def profiled(method):
+    """ Records the calls of the method of GraphCompiler to its profiler, if the profiler is set. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.profiler.record_call(method.__name__, time.perf_counter() - start)
+    return wrapper
+
+# The grammars loaded in the worker processes of an executor, keyed by (grammar_path, grammar_cache_dir).
+_worker_grammars = {}
+
+def _search_rules(grammar, rule_names, graph):
+    """ Searches the whole graph for the targets of the rules. Called by the workers of an executor.
+
+    Args:
+        grammar(GGDLParser or tuple): The grammar, or a pair (grammar_path, grammar_cache_dir).
+                                      The pair is given to worker processes,
+                                      which load the grammar at the first call and keep it.
+        rule_names(list): The names of the rules.
+        graph(DiGraph or bytes): The graph, or the pickled graph given to worker processes.
+                                 It must not be modified until the search finishes.
+
+    Returns:
+        list: Pairs (targets, elapsed) for the rules. elapsed is the time of the search in seconds.
+
+    """
+    if isinstance(graph, bytes):
+        graph = pickle.loads(graph)
+    if isinstance(grammar, tuple):
+        if grammar not in _worker_grammars:
+            _worker_grammars[grammar] = GGDLParser(grammar[0], cache_dir=grammar[1])
+        grammar = _worker_grammars[grammar]
+    ret = []
+    for rule_name in rule_names:
+        start = time.perf_counter()
+        targets = grammar.rules[rule_name].get_target_subgraph(graph)
+        ret.append((targets, time.perf_counter() - start))
+    return ret
 
 class GraphCompiler():
     """ 
@@ -13,16 +66,72 @@ class GraphCompiler():
     and is implemented by using networkx.
 
     To add nodes with a same symbol separately,
-    each instance of the class has an unique id pool (__id_pool).
+    each instance of the class has an unique ID allocator (__id_allocator).
     Each node of __graph is distinguished / accessed by the ID.
 
+    To avoid searching the whole graph for every rule after each rewrite,
+    the matches of the rules are stored in the match index (__match_index).
+    A rewrite changes only the nodes replaced by the rule and the edges around them.
+    Therefore, after each rewrite, only the matches touching the changed nodes are 
+    discarded and searched again.
+    Moreover, only the rules which can replace a node with the symbol of a changed node
+    are searched (__rules_by_symbol).
+
+    In addition, the IDs of the nodes are indexed by their symbols (__symbol_index).
+    The targets of context-free rules are read directly from the symbol index,
+    and the number of nodes with non-terminal symbols is counted (__non_terminal_count).
+
+    The graphs returned by get_graph are frozen snapshots shared with __graph.
+    While __graph is shared (__graph_shared), it is copied before the next modification
+    (copy-on-write), so reading the graph does not cost a copy of the whole graph.
+    The initial graph and its indexes are shared in the same manner for reset_graph.
+
+    The class of __graph (graph_class) is the networkx DiGraph by default.
+    CompactDiGraph of compact_graph.py can be used instead to save memory.
+
+    When a RuleProfiler of rule_profiler.py is set to the profiler member,
+    the searches for the targets and the rewrites are measured for each rule,
+    as well as the calls of get_applicable_rule, sample_applicable_rule, apply_rule and so on.
+    Nothing is measured while the profiler is None (default).
+
+    The rewrites can be recorded as a DerivationTrace of derivation_trace.py (see start_trace),
+    and a recorded trace is replayed by replay_trace without searching for the targets.
+
+    When an executor (concurrent.futures) is set to the executor member, the searches of the whole graph
+    for the targets of the rules (e.g. in load_graph) are split into as many tasks as executor_workers.
+    A ThreadPoolExecutor shares __graph, which pays off on a free-threaded build of python.
+    For a ProcessPoolExecutor, __graph is pickled (as a nx.DiGraph) once for each search and sent to each task,
+    and its workers load the grammar once, so it pays off only for large graphs.
+    The searches after each rewrite are small and always done in the current thread.
+
     """
-    def __init__(self, grammar_path, graph=None, chunk_size=100):
-        self.__grammar = GGDLParser(grammar_path)
+    def __init__(self, grammar_path, graph=None, chunk_size=100, graph_class=nx.DiGraph, 
+            grammar_cache_dir=None, profiler=None, executor=None, executor_workers=None):
+        """
+        Args:
+            grammar_path(str): A path to the grammar file.
+            graph(DiGraph or None): A graph to be loaded. If None, the start graph of the grammar is used.
+            chunk_size(int, optional): Not used any more. Kept for compatibility.
+            graph_class(class, optional): The class of __graph. nx.DiGraph or CompactDiGraph.
+            grammar_cache_dir(str or None, optional): A directory for the cache of the parsed grammar.
+                                                      See the description of the GGDLParser class.
+            profiler(RuleProfiler or None, optional): A profiler. See the description of the class.
+            executor(Executor or None, optional): An executor for the searches. See the description of the class.
+            executor_workers(int or None, optional): The number of the workers of the executor.
+                                                     If None, the max_workers of the executor is used.
 
+        """
+        self.__grammar = GGDLParser(grammar_path, cache_dir=grammar_cache_dir)
+        self.__grammar_source = (os.path.abspath(grammar_path), grammar_cache_dir)
+        self.__rules_by_symbol = self.__index_rules()
+
+        self.graph_class = graph_class
+        self.profiler = profiler
+        self.executor = executor
+        self.executor_workers = executor_workers
+        self.__trace = None
         self.chunk_size = chunk_size
-        self.__id_pool = set([i for i in range(chunk_size)])
-        self.__id_max = max(self.__id_pool)
+        self.__id_allocator = IdAllocator()
 
         if graph is None:
             self.initialize_graph()
@@ -34,14 +143,19 @@ class GraphCompiler():
     #   General methods for handling graphs
     #
     ############################################################
-    def load_graph(self, graph):
+    def load_graph(self, graph, build_index=True):
         """ Loads a nx.DiGraph class graph.
 
         To avoid side-effects on the given graph, 
         a deepcopied graph is passed to __graph.
+        A frozen graph of graph_class, e.g. a snapshot returned by get_graph, is never modified,
+        so it is shared without copying.
 
         Args:
-            graph(DiGraph): A graph to be loaded.
+            graph(DiGraph or CompactDiGraph): A graph to be loaded.
+            build_index(bool, optional): If False, the search for the targets of the rules is put off
+                                         until the targets are requested.
+                                         Useful when the graph is only replayed or compiled.
 
         """
         # Check all the symbols in the given graph belong to the vocabulary.
@@ -61,44 +175,58 @@ class GraphCompiler():
                     "The given graph contains symbols do not belong to the vocabulary:\n" + \
                             str(illegal_symbols))
 
-        # Reset __id_pool
-        self.__reset_pool()
-        self.__remove_pool(set(graph.nodes()))
+        self.__id_allocator.reset()
+        self.__id_allocator.reserve(graph.nodes)
 
-        self.__graph = copy.deepcopy(graph)
-        self.__initial_graph = copy.deepcopy(graph)
+        if not (nx.is_frozen(graph) and isinstance(graph, self.graph_class)):
+            graph = nx.freeze(self.__copy_graph(graph))
+        self.__set_initial_graph(graph, build_index)
 
     def initialize_graph(self):
         """ Initializes __graph with the start-symbol of the grammar. """
         if self.__grammar.start_graph is None:
-            # Reset __id_pool
-            self.__reset_pool()
-            self.__graph = None
-            self.__initial_graph = None
+            self.__id_allocator.reset()
+            self.__set_initial_graph(None)
         else:
-            self.__reset_pool()
-            id_converter = {node_id:self.__pop_id() for node_id in self.__grammar.start_graph.nodes()}
-            self.__graph = self.__grammar.start_graph.convert_into_networkx(id_converter=id_converter)
-            self.__initial_graph = copy.deepcopy(self.__graph)
+            self.__id_allocator.reset()
+            id_converter = {node_id:self.__id_allocator.pop() for node_id in self.__grammar.start_graph.nodes()}
+            graph = self.__grammar.start_graph.convert_into_networkx(id_converter=id_converter)
+            if self.graph_class is not nx.DiGraph:
+                graph = self.graph_class.from_graph(graph)
+            self.__set_initial_graph(nx.freeze(graph))
     
     def reset_graph(self):
-        """ Resets __graph. """
-        self.__reset_pool()
-        self.__remove_pool(set(self.__initial_graph.nodes()))
-        self.__graph = copy.deepcopy(self.__initial_graph)
+        """ Resets __graph. 
+
+        The initial graph and its indexes are shared instead of rebuilt.
+
+        """
+        self.__graph = self.__initial_graph
+        self.__graph_shared = True
+        match_index, symbol_index, non_terminal_count, id_allocator = self.__initial_index
+        self.__id_allocator = id_allocator.copy()
+        # The lists in the match index are replaced, not modified, by __update_match_index.
+        self.__match_index = None if match_index is None else dict(match_index)
+        self.__symbol_index = {symbol: dict(node_ids) for symbol, node_ids in symbol_index.items()}
+        self.__non_terminal_count = non_terminal_count
 
     def get_graph(self):
-        """ Returns a copy of __graph.
+        """ Returns a snapshot of __graph.
         
-        To avoid manually modification of __graph, 
-        a deepcopied graph object is returned.
+        To avoid manually modification of __graph, the snapshot is frozen.
+        The snapshot is shared with __graph until the next modification of __graph,
+        so this method does not copy the graph.
+        Use the copy method of the snapshot to get a modifiable copy.
         
         """
-        return copy.deepcopy(self.__graph)
+        if self.__graph is not None:
+            self.__graph_shared = True
+            nx.freeze(self.__graph)
+        return self.__graph
 
     def get_id_pool(self):
-        """ Returns a copy of __id_pool. """
-        return copy.deepcopy(self.__id_pool)
+        """ Returns a snapshot of __id_allocator. """
+        return self.__id_allocator.copy()
 
     def get_label(self, node_id, label_type='name'):
         """ Gets a symbol from a node with the node_id.
@@ -129,10 +257,13 @@ class GraphCompiler():
             node_id(int): The id of the newly added node.
 
         """
-        node_id = self.__pop_id()
+        node_id = self.__id_allocator.pop()
         attribute = copy.deepcopy(label_dict)
         attribute['name'] = symbol
+        self.__own_graph()
         self.__graph.add_nodes_from([(node_id, attribute)])
+        self.__index_node(node_id)
+        self.__update_match_index({node_id})
         return node_id
 
     def remove_node(self, node_id):
@@ -145,8 +276,13 @@ class GraphCompiler():
             The networkx removes the all edges connecting with a removed node.
          
         """
+        touched_nodes = self.__get_neighborhood({node_id})
+        symbol = self.get_symbol(node_id)
+        self.__own_graph()
         self.__graph.remove_node(node_id)
-        self.__push_id(node_id)
+        self.__id_allocator.push(node_id)
+        self.__unindex_node(node_id, symbol)
+        self.__update_match_index(touched_nodes, (symbol,))
 
     def add_edge(self, start_id, end_id, label_dict={}):
         """ Adds an edge between start_id and end_id. 
@@ -157,7 +293,9 @@ class GraphCompiler():
             label_dict(dict): The attribute for the edge.
         
         """
-        self.__graph.add_edge(from_id, to_id, **label_dict)
+        self.__own_graph()
+        self.__graph.add_edge(start_id, end_id, **label_dict)
+        self.__update_match_index({start_id, end_id})
 
     def remove_edge(self, start_id, end_id):
         """ Removes the edge (start_id, end_id).
@@ -167,7 +305,9 @@ class GraphCompiler():
             end_id(int): The ID of the node where the edge ends.
         
         """
-        self.__graph.remove_edge(from_id, to_id)
+        self.__own_graph()
+        self.__graph.remove_edge(start_id, end_id)
+        self.__update_match_index({start_id, end_id})
 
 
     def get_node_list(self, data=False):
@@ -189,15 +329,64 @@ class GraphCompiler():
         return list(self.__graph.edges(data=data))
 
 
+    def get_symbol_node(self, symbol):
+        """ Returns a list of IDs of nodes which have the given symbol. 
+
+        The IDs are read from the symbol index, so the cost does not depend on the size of the graph.
+        
+        Args:
+            symbol(str): A symbol.
+
+        """
+        return list(self.__symbol_index.get(symbol, ()))
+
+    def get_symbol_groups(self):
+        """ Returns a list of tuples (symbol, node_ids) read from the symbol index.
+
+        Each symbol in the graph appears once, in the order of the symbol index,
+        and node_ids is a list of IDs of the nodes which have the symbol.
+        Therefore, the nodes are visited in the same order as get_terminal_symbol_node.
+
+        """
+        return [(symbol, list(node_ids)) for symbol, node_ids in self.__symbol_index.items()]
+
+    def get_terminal_symbols(self):
+        """ Returns a set of the terminal symbols of the grammar. """
+        return set(self.__grammar.terminal_symbol_set)
+
     def get_terminal_symbol_node(self):
-        """ Returns a list of IDs of nodes which have non-terminal-symbol. """
-        return [node_id for node_id in self.get_node_list()
-                if self.is_terminal_symbol_node(node_id)]
+        """ Returns a list of IDs of nodes which have terminal-symbol. 
+
+        Note:
+            The IDs are grouped by the symbols.
+        
+        """
+        if self.count_terminal_symbol_node() == 0:
+            return []
+        return [node_id for symbol, node_ids in self.__symbol_index.items()
+                if self.__grammar.is_terminal_symbol(symbol) for node_id in node_ids]
  
     def get_non_terminal_symbol_node(self):
-        """ Returns a list of IDs of nodes which have non-terminal-symbol. """
-        return [node_id for node_id in self.get_node_list()
-                if self.is_non_terminal_symbol_node(node_id)]
+        """ Returns a list of IDs of nodes which have non-terminal-symbol. 
+
+        Note:
+            The IDs are grouped by the symbols.
+        
+        """
+        if self.count_non_terminal_symbol_node() == 0:
+            return []
+        return [node_id for symbol, node_ids in self.__symbol_index.items()
+                if self.__grammar.is_non_terminal_symbol(symbol) for node_id in node_ids]
+
+    def count_terminal_symbol_node(self):
+        """ Returns the number of nodes which have terminal-symbol. """
+        if self.__graph is None:
+            return 0
+        return self.__graph.number_of_nodes() - self.__non_terminal_count
+
+    def count_non_terminal_symbol_node(self):
+        """ Returns the number of nodes which have non-terminal-symbol. """
+        return self.__non_terminal_count
 
     def is_terminal_symbol_node(self, node_id):
         """ Checks if the given symbol is a terminal symbol of the grammar.
@@ -219,34 +408,127 @@ class GraphCompiler():
 
     def is_sentence(self):
         """ Checks if the __graph consists of only terminal symbols. """
-        return 0 == len(self.get_non_terminal_symbol_node())
+        return 0 == self.__non_terminal_count
  
+    @profiled
     def get_applicable_rule(self):
-        """ Finds the target subgraphs to which each rule can apply.
+        """ Returns the target subgraphs to which each rule can apply.
+
+        The targets are read from the match index, which is kept up to date by apply_rule.
 
         Returns:
             dict: Each key is the name of a rule.
-                  The value is a list returned by the get_target_subgraph method of the rule.
+                  The value is a list of targets as returned by the get_target_subgraph method of the rule.
 
         """
-        ret = {}
-        for rule_name in self.__grammar.rules:
-            ret[rule_name] = self.__grammar.rules[rule_name].get_target_subgraph(self.__graph)
+        return {rule_name: self.__get_targets(rule_name) for rule_name in self.__grammar.rules}
 
-        return ret
+    def iter_applicable_rule(self, rule_names=None):
+        """ Yields the pairs of a rule and a target to which the rule can apply.
 
-    def is_there_no_applicable_rules(self, applicable_rule_dict):
+        Unlike get_applicable_rule, no lists of the targets are created.
+
+        Note:
+            Do not modify the graph until the iteration finishes.
+
+        Args:
+            rule_names(iterable or None): The names of the rules to be considered.
+                                          If None, all the rules of the grammar are considered.
+
+        Yields:
+            tuple: (rule_name, target)
+
+        """
+        for rule_name in self.__select_rules(rule_names):
+            for target in self.__iter_targets(rule_name):
+                yield rule_name, target
+
+    @profiled
+    def get_first_applicable_rule(self, rule_names=None):
+        """ Returns the first rule in the order of the grammar which has a target, and its first target.
+
+        Args:
+            rule_names(iterable or None): The names of the rules to be considered.
+                                          If None, all the rules of the grammar are considered.
+
+        Returns:
+            tuple: (rule_name, target). (None, None) if no rules are applicable.
+
+        """
+        for rule_name, target in self.iter_applicable_rule(rule_names):
+            return rule_name, target
+        return None, None
+
+    @profiled
+    def sample_applicable_rule(self, rng=None, rule_names=None):
+        """ Chooses a rule and its target randomly.
+
+        A rule is chosen uniformly from the applicable rules, 
+        and then a target is chosen uniformly from the targets of the rule.
+        Both choices are made by reservoir sampling, 
+        so neither the applicable rules nor the targets are collected into lists.
+
+        Args:
+            rng(random.Random, numpy.random.Generator or None): A random number generator. 
+                                                               If None, the random module is used.
+            rule_names(iterable or None): The names of the rules to be considered.
+                                          If None, all the rules of the grammar are considered.
+
+        Returns:
+            tuple: (rule_name, target). (None, None) if no rules are applicable.
+
+        """
+        if rng is None:
+            rng = random
+        rule_name = self.__reservoir_sample(
+                (rule_name for rule_name in self.__select_rules(rule_names) 
+                    if self.__has_target(rule_name)), rng)
+        if rule_name is None:
+            return None, None
+        return rule_name, self.__reservoir_sample(self.__iter_targets(rule_name), rng)
+
+    @profiled
+    def has_applicable_rule(self, rule_names=None):
+        """ Checks if any rule has a target, stopping at the first target found.
+
+        While the match index is up to date, this only looks at the index.
+        Otherwise (e.g. after apply_rules_by_worklist or replay_trace), the index is not rebuilt.
+        Instead, the rules are searched lazily one by one (see BaseRule.is_applicable),
+        skipping the rules which replace none of the symbols in the graph.
+
+        Args:
+            rule_names(iterable or None): The names of the rules to be considered.
+                                          If None, all the rules of the grammar are considered.
+
+        """
+        for rule_name in self.__select_rules(rule_names):
+            rule = self.__grammar.rules[rule_name]
+            if self.__is_context_free_rule(rule) or self.__match_index is not None:
+                if self.__has_target(rule_name):
+                    return True
+                continue
+            if all(len(self.__symbol_index.get(symbol, ())) == 0 for symbol in rule.get_replaced_symbols()):
+                continue
+            if rule.is_applicable(self.__graph):
+                return True
+        return False
+
+    def is_there_no_applicable_rules(self, applicable_rule_dict=None):
         """ Check if all the values of get_applicable_rule is []. 
         
         Args:
-            applicable_rule_dict(dict): The returnd list by the get_applicable_rule.
+            applicable_rule_dict(dict or None): The returnd list by the get_applicable_rule.
+                                                If None, has_applicable_rule is used instead.
         
         """
+        if applicable_rule_dict is None:
+            return not self.has_applicable_rule()
         for v in applicable_rule_dict.values():
             if len(v) != 0:
                 return False
         return True
 
+    @profiled
     def apply_rule(self, rule_name, target):
         """ Applys the given rule to the target.
 
@@ -255,37 +537,547 @@ class GraphCompiler():
             target: Choose from a list in the result of the get_applicable_rule. 
 
         """
-        self.__grammar.rules[rule_name].apply_rule(target, self.__graph, lambda x:self.__pop_id())
+        touched_nodes, replaced_nodes = self.__rewrite(rule_name, target)
+        self.__update_match_index(touched_nodes, replaced_nodes.values())
 
-    def __pop_id(self):
-        """ Pops an unique number for an ID for a node. """
-        ret = self.__id_pool.pop()
-        if len(self.__id_pool) == 0:
-            self.__refill_id_pool()
+    @profiled
+    def apply_rules_batch(self, rewrites):
+        """ Applies the rules to the targets at once and updates the match index only once.
+
+        The targets must not share any node, including the anchor nodes and the wildcard nodes.
+        Then, a rewrite never invalidates the other targets, 
+        and the result is the same as applying them one by one with apply_rule
+        (except for the order of the edges).
+        The changes of all the rewrites are collected first, 
+        and then the graph is modified once by add_nodes_from, add_edges_from and remove_nodes_from.
+
+        Args:
+            rewrites(iterable): Pairs (rule_name, target) chosen from the result of get_applicable_rule.
+
+        Raises:
+            ValueError: A rule does not exist, a target does not fit the graph, or two targets overlap.
+                        Nothing is applied in this case.
+
+        """
+        rewrites = list(rewrites)
+        used_nodes = {}
+        for i, (rule_name, target) in enumerate(rewrites):
+            self.__check_target(rule_name, target, "Rewrite " + str(i))
+            for node_id in self.__get_target_image(target):
+                if node_id in used_nodes:
+                    raise ValueError("Rewrite " + str(i) + ": the target " + str(target) + 
+                            " overlaps with that of rewrite " + str(used_nodes[node_id]) + ".")
+                used_nodes[node_id] = i
+
+        touched_nodes, replaced_nodes = self.__rewrite_batch(rewrites)
+        self.__update_match_index(touched_nodes, set(replaced_nodes.values()))
+
+    @profiled
+    def apply_rules_by_worklist(self, callback=None):
+        """ Applies the rules until no rules are applicable, visiting the nodes with a worklist.
+
+        The nodes which some rules can replace are put into a queue in the order of the symbol index.
+        For each node taken from the queue, the rules which can replace it are searched 
+        only around the node, in the order of the grammar, and the first target found is rewritten.
+        The nodes touched by the rewrite are put into the queue again.
+        The match index is not updated during the rewrites, 
+        but rebuilt when the targets of a rule are requested next time.
+
+        The result is deterministic.
+        However, the rewrites are not in the order of get_first_applicable_rule, 
+        so use this method only for grammars whose results do not depend on the priority of the rules.
+
+        Args:
+            callback(function or None): If given, called with (rule_name, target) before each rewrite.
+
+        Returns:
+            int: The number of the rewrites.
+
+        """
+        queue = collections.deque(node_id for symbol, node_ids in self.__symbol_index.items() 
+                if symbol in self.__rules_by_symbol for node_id in node_ids)
+        queued = set(queue)
+        count = 0
+        while len(queue) != 0:
+            node_id = queue.popleft()
+            queued.discard(node_id)
+            if node_id not in self.__graph.nodes:
+                continue
+            rule_name, target = self.__find_target_at(node_id)
+            if rule_name is None:
+                continue
+            if callback is not None:
+                callback(rule_name, target)
+            touched_nodes, replaced_nodes = self.__rewrite(rule_name, target)
+            count += 1
+            # A new target always contains a touched node. 
+            for touched_node_id in sorted(touched_nodes):
+                if touched_node_id in queued or touched_node_id not in self.__graph.nodes:
+                    continue
+                if self.get_symbol(touched_node_id) in self.__rules_by_symbol:
+                    queue.append(touched_node_id)
+                    queued.add(touched_node_id)
+        # None means that the match index is out of date.
+        self.__match_index = None
+        return count
+
+    @profiled
+    def apply_rules_by_rounds(self, callback=None):
+        """ Applies the rules until no rules are applicable, rewriting disjoint targets in rounds.
+
+        In each round, the targets of get_applicable_rule are taken in the order of the grammar,
+        skipping the ones which overlap with the targets already taken,
+        and they are rewritten at once by apply_rules_batch.
+
+        The result is deterministic.
+        However, the rewrites are not in the order of get_first_applicable_rule, 
+        so use this method only for grammars whose results do not depend on the priority of the rules.
+
+        Args:
+            callback(function or None): If given, called with (rule_name, target) before each rewrite.
+
+        Returns:
+            int: The number of the rewrites.
+
+        """
+        count = 0
+        while True:
+            rewrites = []
+            used_nodes = set()
+            for rule_name, targets in self.get_applicable_rule().items():
+                for target in targets:
+                    image = self.__get_target_image(target)
+                    if used_nodes.isdisjoint(image):
+                        used_nodes.update(image)
+                        rewrites.append((rule_name, target))
+            if len(rewrites) == 0:
+                return count
+            if callback is not None:
+                for rule_name, target in rewrites:
+                    callback(rule_name, target)
+            self.apply_rules_batch(rewrites)
+            count += len(rewrites)
+
+    def start_trace(self, metadata=None):
+        """ Starts recording the rewrites applied to __graph.
+
+        The trace is replayed by replay_trace on the same graph as the current one
+        with the same IDs, e.g. the graph right after initialize_graph or load_graph.
+
+        Args:
+            metadata(dict or None): The metadata of the trace. See DerivationTrace.
+
+        Returns:
+            DerivationTrace: The trace to which the rewrites are appended.
+
+        """
+        self.__trace = DerivationTrace(metadata=metadata)
+        return self.__trace
+
+    def stop_trace(self):
+        """ Stops recording the rewrites and returns the trace (None if not recording). """
+        trace = self.__trace
+        self.__trace = None
+        return trace
+
+    @profiled
+    def replay_trace(self, trace):
+        """ Applies the rewrites recorded in the trace without searching for the targets.
+
+        The match index is not updated during the replay,
+        but rebuilt when the targets of a rule are requested next time.
+        When recording, the replayed rewrites are appended to the current trace.
+
+        Args:
+            trace(DerivationTrace or iterable): The trace, or pairs (rule_name, target).
+
+        Raises:
+            ValueError: A step of the trace does not fit the graph, 
+                        i.e. the trace was recorded from another graph.
+
+        """
+        for step, (rule_name, target) in enumerate(trace):
+            self.__check_target(rule_name, target, "Step " + str(step))
+            self.__rewrite(rule_name, target)
+        self.__match_index = None
+
+    def __check_target(self, rule_name, target, context):
+        """ Raises ValueError with the context (e.g. "Step 3") if the rule cannot apply to the target.
+
+        Only the existence of the nodes and the symbols of the replaced nodes are checked.
+
+        """
+        if rule_name not in self.__grammar.rules:
+            raise ValueError(context + ": the rule " + str(rule_name) + " does not exist.")
+        rule = self.__grammar.rules[rule_name]
+        try:
+            if self.__is_context_free_rule(rule) == isinstance(target, dict):
+                raise KeyError(target)
+            target_nodes = rule.get_target_nodes(target)
+        except KeyError:
+            raise ValueError(context + ": " + str(target) + " is not a target of the rule " + rule_name + ".")
+        replaced_symbols = rule.get_replaced_symbols()
+        for node_id in target_nodes:
+            if node_id not in self.__graph.nodes or self.get_symbol(node_id) not in replaced_symbols:
+                raise ValueError(context + ": the rule " + rule_name + 
+                        " cannot apply to the target " + str(target) + ".")
+        for node_id in self.__get_target_image(target):
+            if node_id not in self.__graph.nodes:
+                raise ValueError(context + ": the node " + str(node_id) + " does not exist.")
+
+    @classmethod
+    def __get_target_image(cls, target):
+        """ Returns a set of IDs of the nodes which the target maps to, including the anchors and the wildcards. """
+        if isinstance(target, dict):
+            return {node_id for node_id in target.values() if node_id is not None}
+        return {target}
+
+    def __rewrite(self, rule_name, target):
+        """ Applies the rule to the target and updates the symbol index (not the match index).
+
+        Returns:
+            tuple: (touched_nodes, replaced_nodes)
+                touched_nodes(set): IDs of the nodes added, removed,
+                                    or connected with added / removed edges.
+                replaced_nodes(dict): The symbols of the removed nodes keyed by their IDs.
+
+        """
+        if self.profiler is not None:
+            start = time.perf_counter()
+        rule = self.__grammar.rules[rule_name]
+        # The rewrite changes only the replaced nodes, the edges connecting with them,
+        # and the newly added nodes.
+        replaced_nodes = {node_id: self.get_symbol(node_id) for node_id in rule.get_target_nodes(target)}
+        touched_nodes = self.__get_neighborhood(replaced_nodes)
+        new_nodes = []
+
+        def id_generator(rhs_node_id):
+            node_id = self.__id_allocator.pop()
+            new_nodes.append(node_id)
+            return node_id
+
+        self.__own_graph()
+        rule.apply_rule(target, self.__graph, id_generator)
+        for node_id, symbol in replaced_nodes.items():
+            self.__unindex_node(node_id, symbol)
+        for node_id in new_nodes:
+            self.__index_node(node_id)
+        touched_nodes.update(new_nodes)
+        if self.__trace is not None:
+            self.__trace.append(rule_name, target)
+        if self.profiler is not None:
+            self.profiler.record_rewrite(rule_name, time.perf_counter() - start, 
+                    len(replaced_nodes), len(new_nodes))
+        return touched_nodes, replaced_nodes
+
+    def __rewrite_batch(self, rewrites):
+        """ Applies the rules to the disjoint targets in one pass and updates the symbol index.
+
+        The edges reconnected by a context-free rewrite to a node replaced by another context-free rewrite
+        are reconnected to the base node of the other rewrite, as if the rewrites were applied one by one.
+
+        Returns:
+            tuple: (touched_nodes, replaced_nodes). See __rewrite.
+
+        """
+        if self.profiler is not None:
+            start = time.perf_counter()
+        replaced_nodes = {}
+        touched_nodes = set()
+        new_nodes = []
+        plans = []
+        # A node replaced by a context-free rule -> the base node replacing it.
+        base_nodes = {}
+        for rule_name, target in rewrites:
+            rule = self.__grammar.rules[rule_name]
+            new_ids = {}
+
+            def id_generator(rhs_node_id):
+                node_id = self.__id_allocator.pop()
+                new_ids[rhs_node_id] = node_id
+                new_nodes.append(node_id)
+                return node_id
+
+            touched_nodes |= self.__get_neighborhood(rule.get_target_nodes(target))
+            removed, nodes, edges = rule.lower_rule(target, self.__graph, id_generator)
+            replaced_nodes.update((node_id, self.get_symbol(node_id)) for node_id in removed)
+            if self.__is_context_free_rule(rule):
+                base_nodes[target] = new_ids['base']
+            plans.append((set(removed), nodes, edges))
+
+        added_nodes = []
+        added_edges = []
+        for removed, nodes, edges in plans:
+            added_nodes.extend(nodes)
+            # The edges connecting with the own replaced nodes are removed with them.
+            added_edges.extend((base_nodes.get(start, start), base_nodes.get(end, end), label_dict)
+                    for start, end, label_dict in edges if start not in removed and end not in removed)
+
+        self.__own_graph()
+        self.__graph.add_nodes_from(added_nodes)
+        self.__graph.add_edges_from(added_edges)
+        self.__graph.remove_nodes_from(list(replaced_nodes))
+        for node_id, symbol in replaced_nodes.items():
+            self.__unindex_node(node_id, symbol)
+        for node_id in new_nodes:
+            self.__index_node(node_id)
+        touched_nodes.update(new_nodes)
+        if self.__trace is not None:
+            for rule_name, target in rewrites:
+                self.__trace.append(rule_name, target)
+        if self.profiler is not None:
+            # The time of the pass is divided among the rewrites.
+            elapsed = (time.perf_counter() - start) / max(1, len(rewrites))
+            for (rule_name, target), (removed, nodes, edges) in zip(rewrites, plans):
+                self.profiler.record_rewrite(rule_name, elapsed, len(removed), len(nodes))
+        return touched_nodes, replaced_nodes
+
+    def __find_target_at(self, node_id):
+        """ Returns the first rule in the order of the grammar which can replace the node, and its target.
+
+        Returns:
+            tuple: (rule_name, target). (None, None) if no rules can replace the node.
+
+        """
+        for rule_name in self.__rules_by_symbol.get(self.get_symbol(node_id), ()):
+            targets = self.__search(rule_name, {node_id})
+            if len(targets) != 0:
+                return rule_name, targets[0]
+        return None, None
+
+    def __index_rules(self):
+        """ Returns a dictionary which takes a symbol and returns a list of the names of the rules
+        which can replace a node with the symbol, in the order of the grammar. """
+        ret = {}
+        for rule_name in self.__grammar.rules:
+            for symbol in self.__grammar.rules[rule_name].get_replaced_symbols():
+                ret.setdefault(symbol, []).append(rule_name)
         return ret
 
-    def __push_id(self, node_id):
-        """ Returns a number to the pool. 
-        
+    def __set_initial_graph(self, graph, build_index=True):
+        """ Sets the frozen graph (or None) to both __graph and __initial_graph and builds the indexes. 
+
+        If build_index is False, the match index is left out of date (None).
+
+        """
+        self.__initial_graph = graph
+        self.__graph = graph
+        self.__graph_shared = True
+        self.__rebuild_index(build_index)
+        self.__initial_index = (None if self.__match_index is None else dict(self.__match_index),
+                {symbol: dict(node_ids) for symbol, node_ids in self.__symbol_index.items()},
+                self.__non_terminal_count,
+                self.__id_allocator.copy())
+
+    def __copy_graph(self, graph):
+        """ Returns a copy of the graph as a graph_class object. """
+        if isinstance(graph, self.graph_class):
+            if isinstance(graph, nx.DiGraph):
+                return copy.deepcopy(graph)
+            return graph.copy()
+        if self.graph_class is nx.DiGraph:
+            return graph.to_networkx()
+        return self.graph_class.from_graph(graph)
+
+    def __own_graph(self):
+        """ Copies __graph before a modification if it is shared with snapshots. """
+        if self.__graph_shared:
+            self.__graph = self.__graph.copy()
+            self.__graph_shared = False
+
+    def __is_context_free_rule(self, rule):
+        """ Checks if the targets of the rule are read from the symbol index. """
+        return rule['class'] == ContextFreeRule.rule_class
+
+    def __get_targets(self, rule_name):
+        """ Returns a list of the targets of the rule. """
+        return list(self.__iter_targets(rule_name))
+
+    def __iter_targets(self, rule_name):
+        """ Returns an iterator over the targets of the rule. """
+        rule = self.__grammar.rules[rule_name]
+        if self.__is_context_free_rule(rule):
+            return iter(self.__symbol_index.get(rule.get_replaced_symbol(), ()))
+        if self.__match_index is None:
+            self.__rebuild_match_index()
+        return iter(self.__match_index[rule_name])
+
+    def __has_target(self, rule_name):
+        """ Checks if the rule has a target. """
+        for target in self.__iter_targets(rule_name):
+            return True
+        return False
+
+    def __select_rules(self, rule_names):
+        """ Returns the names of the rules of the grammar in rule_names, keeping the order of the grammar. """
+        if rule_names is None:
+            return list(self.__grammar.rules)
+        rule_names = set(rule_names)
+        return [rule_name for rule_name in self.__grammar.rules if rule_name in rule_names]
+
+    @classmethod
+    def __reservoir_sample(cls, iterable, rng):
+        """ Chooses an element of the iterable uniformly in a single pass. None if it is empty. 
+
         Args:
-            node_id(number): A number pop from the pool.
-        
+            iterable(iterable): The elements to be chosen.
+            rng(random.Random or numpy.random.Generator): A random number generator.
+
         """
-        self.__id_pool.add(node_id)
+        # random.Random has randrange, and numpy.random.Generator has integers.
+        try:
+            randrange = rng.randrange
+        except AttributeError:
+            randrange = rng.integers
+        chosen = None
+        for count, element in enumerate(iterable, 1):
+            if randrange(count) == 0:
+                chosen = element
+        return chosen
+
+    def __index_node(self, node_id):
+        """ Registers the node in the symbol index. """
+        symbol = self.get_symbol(node_id)
+        # dict is used as an insertion-ordered set.
+        if symbol not in self.__symbol_index:
+            self.__symbol_index[symbol] = {node_id: None}
+        else:
+            self.__symbol_index[symbol][node_id] = None
+        if self.__grammar.is_non_terminal_symbol(symbol):
+            self.__non_terminal_count += 1
 
-    def __refill_id_pool(self):
-        """ Refills the id pool. """
-        self.__id_pool.update([i for i in 
-            range(self.__id_max + 1, self.__id_max + self.chunk_size)])
-        self.__id_max = max(self.__id_pool)
+    def __unindex_node(self, node_id, symbol):
+        """ Removes the node from the symbol index.
 
-    def __remove_pool(self, id_set):
-        """ Removes numbers in id_set. """
-        self.__id_pool = self.__id_pool - id_set
+        Args:
+            node_id(int): The ID of the removed node.
+            symbol(str): The symbol the node had.
 
-    def __reset_pool(self):
-        """ Resets __id_pool to the initial state. """
-        self.__id_pool = set([i for i in range(self.chunk_size)])
+        """
+        node_ids = self.__symbol_index[symbol]
+        node_ids.pop(node_id)
+        if len(node_ids) == 0:
+            self.__symbol_index.pop(symbol)
+        if self.__grammar.is_non_terminal_symbol(symbol):
+            self.__non_terminal_count -= 1
+
+    def __rebuild_index(self, build_match_index=True):
+        """ Rebuilds the symbol index and the match index from the whole __graph. 
+
+        If build_match_index is False, the match index is rebuilt when the targets are requested next time.
+
+        """
+        self.__symbol_index = {}
+        self.__non_terminal_count = 0
+        if self.__graph is not None:
+            for node_id in self.__graph.nodes:
+                self.__index_node(node_id)
+        if build_match_index:
+            self.__rebuild_match_index()
+        else:
+            self.__match_index = None
+
+    def __get_neighborhood(self, node_ids):
+        """ Returns a set of the given nodes and the nodes adjacent to them. """
+        ret = set(node_ids)
+        for node_id in node_ids:
+            ret.update(edge[0] for edge in self.__graph.in_edges(node_id))
+            ret.update(edge[1] for edge in self.__graph.out_edges(node_id))
+        return ret
+
+    def __rebuild_match_index(self):
+        """ Searches the whole __graph for the targets of all the rules. """
+        rule_names = [rule_name for rule_name in self.__grammar.rules
+                if not self.__is_context_free_rule(self.__grammar.rules[rule_name])]
+        if self.__graph is None:
+            self.__match_index = {rule_name: [] for rule_name in rule_names}
+        elif self.executor is None:
+            self.__match_index = {rule_name: self.__search(rule_name) for rule_name in rule_names}
+        else:
+            self.__match_index = self.__search_in_parallel(rule_names)
+
+    def __search_in_parallel(self, rule_names):
+        """ Searches the whole __graph for the targets of the rules with the executor.
+
+        The rules are dealt out into as many tasks as the workers of the executor,
+        and the results are merged in the order of rule_names.
+
+        Returns:
+            dict: A dictionary which takes a rule name and returns a list of its targets.
+
+        """
+        if isinstance(self.executor, ProcessPoolExecutor):
+            grammar = self.__grammar_source
+            graph = self.__graph if isinstance(self.__graph, nx.DiGraph) else self.__graph.to_networkx()
+            # Pickled here once, instead of once for each task by the executor.
+            graph = pickle.dumps(graph, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            grammar = self.__grammar
+            graph = self.__graph
+        workers = self.executor_workers
+        if workers is None:
+            workers = getattr(self.executor, '_max_workers', None) or os.cpu_count() or 1
+        task_num = max(1, min(len(rule_names), workers))
+        chunks = [rule_names[i::task_num] for i in range(task_num)]
+        futures = [self.executor.submit(_search_rules, grammar, chunk, graph) for chunk in chunks]
+        results = {}
+        for chunk, future in zip(chunks, futures):
+            for rule_name, (targets, elapsed) in zip(chunk, future.result()):
+                results[rule_name] = targets
+                if self.profiler is not None:
+                    self.profiler.record_search(rule_name, elapsed, len(targets))
+        return {rule_name: results[rule_name] for rule_name in rule_names}
+
+    def __search(self, rule_name, around=None):
+        """ Returns a list of the targets of the rule in __graph, measuring the search if profiled.
+
+        Args:
+            rule_name(str): The name of the rule.
+            around(set or None): If given, only the targets containing one of the nodes are searched for.
+                                 See get_target_subgraph_around of the rule.
+
+        """
+        rule = self.__grammar.rules[rule_name]
+        if self.profiler is None:
+            if around is None:
+                return rule.get_target_subgraph(self.__graph)
+            return rule.get_target_subgraph_around(self.__graph, around)
+        start = time.perf_counter()
+        if around is None:
+            targets = rule.get_target_subgraph(self.__graph)
+        else:
+            targets = rule.get_target_subgraph_around(self.__graph, around)
+        self.profiler.record_search(rule_name, time.perf_counter() - start, len(targets))
+        return targets
+
+    def __update_match_index(self, touched_nodes, removed_symbols=()):
+        """ Updates the match index after the nodes in touched_nodes are modified.
+
+        A target remains valid unless one of its nodes is touched, since the labels,
+        the degrees and the neighbors of the other nodes do not change.
+        Conversely, a newly valid target always contains a touched node.
+        Therefore, the targets of the rules which cannot replace any touched node do not change.
+
+        Args:
+            touched_nodes(set): IDs of the nodes added, removed,
+                                or connected with added / removed edges.
+            removed_symbols(iterable): The symbols of the removed nodes.
+
+        """
+        if self.__match_index is None:
+            return
+        symbols = set(removed_symbols)
+        symbols.update(self.get_symbol(node_id) for node_id in touched_nodes 
+                if node_id in self.__graph.nodes)
+        rule_names = {rule_name for symbol in symbols for rule_name in self.__rules_by_symbol.get(symbol, ())}
+        for rule_name in self.__match_index:
+            if rule_name not in rule_names:
+                continue
+            rule = self.__grammar.rules[rule_name]
+            matches = [target for target in self.__match_index[rule_name]
+                    if touched_nodes.isdisjoint(rule.get_target_nodes(target))]
+            matches += self.__search(rule_name, touched_nodes)
+            self.__match_index[rule_name] = matches
  
 
 from grammar import Grammar
@@ -0,0 +1,94 @@
+""" Canonical hashing of the derived graphs """
+
+import warnings
+import networkx as nx
+from networkx.algorithms.isomorphism import categorical_node_match
+
+_node_match = categorical_node_match('name', None)
+
+def canonical_hash(graph, iterations=3):
+    """ Returns a hash of the graph which does not depend on the node IDs.
+
+    The hash is the Weisfeiler-Lehman graph hash over the 'name' labels of the nodes.
+    Isomorphic graphs always have the same hash, but graphs with the same hash
+    are not always isomorphic. Use is_same_structure to tell them apart.
+    The hash may change with the version of networkx, so do not compare hashes across environments.
+
+    Args:
+        graph(DiGraph or CompactDiGraph): A graph generated by GraphCompiler.
+        iterations(int): The number of the iterations of the Weisfeiler-Lehman algorithm.
+
+    Returns:
+        str: The hexadecimal hash.
+
+    """
+    if not isinstance(graph, nx.DiGraph):
+        graph = graph.to_networkx()
+    with warnings.catch_warnings():
+        # networkx 3.5 warns that the hashes of directed graphs differ from those of the older versions.
+        warnings.filterwarnings('ignore', message='The hashes produced for directed graphs', 
+                category=UserWarning)
+        return nx.weisfeiler_lehman_graph_hash(graph, node_attr='name', iterations=iterations)
+
+def is_same_structure(graph1, graph2):
+    """ Returns True if the graphs are isomorphic with respect to the 'name' labels of the nodes. """
+    if not isinstance(graph1, nx.DiGraph):
+        graph1 = graph1.to_networkx()
+    if not isinstance(graph2, nx.DiGraph):
+        graph2 = graph2.to_networkx()
+    return nx.is_isomorphic(graph1, graph2, node_match=_node_match)
+
+
+class GraphHashSet():
+    """ A set of graphs identified up to isomorphism.
+
+    The graphs are grouped by canonical_hash, and is_same_structure is called
+    only between graphs with the same hash.
+    A graph can be given as a function which returns the graph,
+    e.g. to read it from a file only when another graph has the same hash.
+
+    Attributes:
+        buckets(dict): A dictionary which takes a hash and returns a list of pairs [key, graph].
+        iterations(int): The number of the iterations for canonical_hash.
+
+    """
+    def __init__(self, iterations=3):
+        self.buckets = {}
+        self.iterations = iterations
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def add(self, key, graph, graph_hash=None):
+        """ Adds the graph unless an isomorphic graph is in the set.
+
+        Args:
+            key: An identifier of the graph, e.g. the robot name.
+            graph(DiGraph, CompactDiGraph or callable): The graph, or a function which returns the graph.
+            graph_hash(str or None): The canonical_hash of the graph. If None, it is calculated.
+
+        Returns:
+            The key of the isomorphic graph in the set, or None if the graph is added.
+
+        """
+        if graph_hash is None:
+            graph = self.__get_graph(graph)
+            graph_hash = canonical_hash(graph, self.iterations)
+        if graph_hash not in self.buckets:
+            self.buckets[graph_hash] = [[key, graph]]
+            return None
+
+        bucket = self.buckets[graph_hash]
+        graph = self.__get_graph(graph)
+        for entry in bucket:
+            entry[1] = self.__get_graph(entry[1])
+            if is_same_structure(graph, entry[1]):
+                return entry[0]
+        bucket.append([key, graph])
+        return None
+
+    @classmethod
+    def __get_graph(cls, graph):
+        if callable(graph):
+            return graph()
+        return graph
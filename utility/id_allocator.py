@@ -0,0 +1,165 @@
+""" IdAllocator """
+
+class IdAllocator():
+    """ An allocator of unique integer IDs for the nodes of a graph.
+
+    The IDs are handed out from the released IDs first, then from the gaps left by reserve,
+    and then from a counter (next_id) which only increases.
+    The released IDs are a stack, so the ID released last is reused first.
+    The gaps are handed out in the increasing order.
+
+    The gaps are stored as intervals, so reserving a large ID costs nothing for the IDs skipped.
+    All the operations are O(1) amortised, except that reserve and the operations on an ID
+    inside a gap are linear in the number of the given IDs / the gaps.
+    The IDs come out deterministically from the sequence of the operations.
+
+    copy shares free, free_set and gaps with the snapshot in O(1).
+    While they are shared (shared), they are copied before the next modification,
+    as GraphCompiler does for its graph.
+
+    An ID reserved while it is on the stack is not removed from the stack at once.
+    Instead, it is skipped when it is popped (free_set holds the released IDs actually free).
+
+    Attributes:
+        next_id(int): The smallest ID which has never been handed out nor reserved.
+        free(list): The stack of the released IDs. May contain IDs which are not free any more.
+        free_set(set): The released IDs below next_id which are free.
+        gaps(list): Tuples (start, stop) of the intervals of the free IDs skipped by reserve,
+                    in the decreasing order of start. The IDs from start to stop - 1 are free.
+        gap_size(int): The total number of the IDs in the gaps.
+        shared(bool): True if free, free_set and gaps may be shared with another allocator.
+
+    """
+    def __init__(self):
+        self.next_id = 0
+        self.free = []
+        self.free_set = set()
+        self.gaps = []
+        self.gap_size = 0
+        self.shared = False
+
+    def __repr__(self):
+        return 'IdAllocator(next_id=' + str(self.next_id) + ', free=' + str(sorted(self.free_set)) + \
+                ', gaps=' + str(list(reversed(self.gaps))) + ')'
+
+    def __len__(self):
+        """ Returns the number of the IDs in use. """
+        return self.next_id - len(self.free_set) - self.gap_size
+
+    def pop(self):
+        """ Returns an unused ID and marks it as used. """
+        if len(self.free) != 0 or len(self.gaps) != 0:
+            self.__own()
+        while len(self.free) != 0:
+            node_id = self.free.pop()
+            if node_id in self.free_set:
+                self.free_set.remove(node_id)
+                return node_id
+        if len(self.gaps) != 0:
+            node_id, stop = self.gaps[-1]
+            if node_id + 1 == stop:
+                self.gaps.pop()
+            else:
+                self.gaps[-1] = (node_id + 1, stop)
+            self.gap_size -= 1
+            return node_id
+        node_id = self.next_id
+        self.next_id += 1
+        return node_id
+
+    def pop_many(self, n):
+        """ Returns a list of n unused IDs and marks them as used. """
+        return [self.pop() for i in range(n)]
+
+    def push(self, node_id):
+        """ Releases the ID so that it can be handed out again.
+
+        Args:
+            node_id(int): An ID handed out by pop or reserved by reserve.
+
+        """
+        if node_id >= self.next_id or node_id in self.free_set or self.__find_gap(node_id) >= 0:
+            raise ValueError("The ID " + str(node_id) + " is not in use.")
+        self.__own()
+        self.free.append(node_id)
+        self.free_set.add(node_id)
+
+    def reserve(self, node_ids):
+        """ Marks the IDs as used, e.g. the IDs of the nodes of a loaded graph.
+
+        Args:
+            node_ids(iterable): Non-negative integers. IDs already in use are ignored.
+
+        """
+        self.__own()
+        new_gaps = []
+        for node_id in sorted(node_ids):
+            if node_id < self.next_id:
+                if node_id in self.free_set:
+                    self.free_set.remove(node_id)
+                else:
+                    self.__remove_from_gap(node_id)
+                continue
+            if node_id > self.next_id:
+                new_gaps.append((self.next_id, node_id))
+                self.gap_size += node_id - self.next_id
+            self.next_id = node_id + 1
+        # The new gaps are above all the existing ones.
+        self.gaps[:0] = reversed(new_gaps)
+
+    def reset(self):
+        """ Marks all the IDs as unused. """
+        self.next_id = 0
+        self.free = []
+        self.free_set = set()
+        self.gaps = []
+        self.gap_size = 0
+        self.shared = False
+
+    def copy(self):
+        """ Returns a snapshot of the allocator in O(1), sharing the free IDs until either is modified. """
+        allocator = self.__class__()
+        allocator.next_id = self.next_id
+        allocator.free = self.free
+        allocator.free_set = self.free_set
+        allocator.gaps = self.gaps
+        allocator.gap_size = self.gap_size
+        allocator.shared = True
+        self.shared = True
+        return allocator
+
+    def __own(self):
+        """ Copies free, free_set and gaps before a modification if they are shared. """
+        if self.shared:
+            self.free = [node_id for node_id in self.free if node_id in self.free_set]
+            self.free_set = set(self.free_set)
+            self.gaps = list(self.gaps)
+            self.shared = False
+
+    def __find_gap(self, node_id):
+        """ Returns the index of the gap containing the ID, or -1. """
+        # The gaps are sorted by start in the decreasing order.
+        low, high = 0, len(self.gaps)
+        while low < high:
+            middle = (low + high) // 2
+            if self.gaps[middle][0] > node_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.gaps) and node_id < self.gaps[low][1]:
+            return low
+        return -1
+
+    def __remove_from_gap(self, node_id):
+        """ Removes the ID from the gap containing it, splitting the gap if needed. """
+        i = self.__find_gap(node_id)
+        if i < 0:
+            return
+        start, stop = self.gaps[i]
+        replacement = []
+        if node_id + 1 < stop:
+            replacement.append((node_id + 1, stop))
+        if start < node_id:
+            replacement.append((start, node_id))
+        self.gaps[i:i + 1] = replacement
+        self.gap_size -= 1
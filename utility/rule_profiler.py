@@ -0,0 +1,136 @@
+""" RuleProfiler """
+
+import csv
+
+class RuleProfiler():
+    """ Collects the costs of the rules while GraphCompiler works.
+
+    Set an instance to the profiler member of a GraphCompiler to enable the profiling.
+    When the member is None (default), GraphCompiler does not measure anything.
+
+    For each rule, the following values are accumulated:
+
+        * searches: The number of the searches for the targets of the rule
+                    (whole graph searches and searches around modified nodes).
+        * search_time: The total time of the searches in seconds.
+        * matches: The total number of the targets found by the searches.
+        * rewrites: The number of the applications of the rule.
+        * rewrite_time: The total time of the applications in seconds,
+                        not including the searches after them.
+        * removed_nodes: The total number of the nodes removed by the applications.
+        * added_nodes: The total number of the nodes added by the applications.
+
+    In addition, the number of the calls and the total time of the methods of GraphCompiler
+    such as get_applicable_rule and apply_rule are accumulated in calls.
+
+    Attributes:
+        rules(dict): A dictionary which takes a rule name and returns a dictionary of the above values.
+        calls(dict): A dictionary which takes a method name and returns a dictionary
+                     with 'count' and 'time'.
+
+    """
+    rule_fields = ['searches', 'search_time', 'matches',
+            'rewrites', 'rewrite_time', 'removed_nodes', 'added_nodes']
+
+    def __init__(self):
+        self.rules = {}
+        self.calls = {}
+
+    def record_search(self, rule_name, elapsed, matches):
+        """ Records a search for the targets of the rule.
+
+        Args:
+            rule_name(str): The name of the rule.
+            elapsed(float): The time of the search in seconds.
+            matches(int): The number of the targets found.
+
+        """
+        stats = self.__get_rule_stats(rule_name)
+        stats['searches'] += 1
+        stats['search_time'] += elapsed
+        stats['matches'] += matches
+
+    def record_rewrite(self, rule_name, elapsed, removed_nodes, added_nodes):
+        """ Records an application of the rule.
+
+        Args:
+            rule_name(str): The name of the rule.
+            elapsed(float): The time of the application in seconds.
+            removed_nodes(int): The number of the removed nodes.
+            added_nodes(int): The number of the added nodes.
+
+        """
+        stats = self.__get_rule_stats(rule_name)
+        stats['rewrites'] += 1
+        stats['rewrite_time'] += elapsed
+        stats['removed_nodes'] += removed_nodes
+        stats['added_nodes'] += added_nodes
+
+    def record_call(self, method_name, elapsed):
+        """ Records a call of a method of GraphCompiler. """
+        if method_name not in self.calls:
+            self.calls[method_name] = {'count': 0, 'time': 0.0}
+        self.calls[method_name]['count'] += 1
+        self.calls[method_name]['time'] += elapsed
+
+    def merge(self, other):
+        """ Adds the values of another RuleProfiler (or its to_dict()) to this profiler.
+
+        This is used to collect the results of worker processes.
+
+        """
+        if isinstance(other, RuleProfiler):
+            other = other.to_dict()
+        for rule_name, other_stats in other['rules'].items():
+            stats = self.__get_rule_stats(rule_name)
+            for field in self.rule_fields:
+                stats[field] += other_stats[field]
+        for method_name, other_call in other['calls'].items():
+            if method_name not in self.calls:
+                self.calls[method_name] = {'count': 0, 'time': 0.0}
+            self.calls[method_name]['count'] += other_call['count']
+            self.calls[method_name]['time'] += other_call['time']
+
+    def reset(self):
+        """ Clears all the values. """
+        self.rules = {}
+        self.calls = {}
+
+    def to_dict(self):
+        """ Returns a copy of the values as a dictionary with 'rules' and 'calls'. """
+        return {
+                'rules': {rule_name: dict(stats) for rule_name, stats in self.rules.items()},
+                'calls': {method_name: dict(call) for method_name, call in self.calls.items()}}
+
+    def get_table(self):
+        """ Returns a list of the values of the rules, sorted by the total time in the descending order.
+
+        Each element is a dictionary with 'rule', the values described above and 'total_time'.
+
+        """
+        table = []
+        for rule_name, stats in self.rules.items():
+            row = {'rule': rule_name}
+            row.update(stats)
+            row['total_time'] = stats['search_time'] + stats['rewrite_time']
+            table.append(row)
+        table.sort(key=lambda row: row['total_time'], reverse=True)
+        return table
+
+    def write_csv(self, path):
+        """ Writes the table of get_table into a csv file. """
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['rule', 'total_time'] + self.rule_fields)
+            writer.writeheader()
+            writer.writerows(self.get_table())
+
+    def __get_rule_stats(self, rule_name):
+        try:
+            return self.rules[rule_name]
+        except KeyError:
+            pass
+        stats = {field: 0 for field in self.rule_fields}
+        stats['search_time'] = 0.0
+        stats['rewrite_time'] = 0.0
+        self.rules[rule_name] = stats
+        return stats
@@ -0,0 +1,94 @@
+""" Structured logging of the derivations """
+
+import sys
+import json
+import logging
+import logging.handlers
+
+# The loggers of this package are children of this logger, e.g. 'ggdl.compiler'.
+ROOT_LOGGER_NAME = 'ggdl'
+logging.getLogger(ROOT_LOGGER_NAME).addHandler(logging.NullHandler())
+
+def get_logger(name):
+    """ Returns the logger 'ggdl.name'.
+
+    Nothing is logged unless a handler is added, e.g. by enable_json_log.
+    The call sites check logger.isEnabledFor before building the fields of an event,
+    so a disabled logger costs only the check.
+
+    Args:
+        name(str): The name of the component, e.g. 'grammar', 'compiler', 'urdf' or 'derivation'.
+
+    """
+    return logging.getLogger(ROOT_LOGGER_NAME + '.' + name)
+
+def log_event(logger, level, event, **fields):
+    """ Logs an event with the fields.
+
+    Args:
+        logger(Logger): A logger returned by get_logger.
+        level(int): The level, e.g. logging.DEBUG.
+        event(str): The name of the event, e.g. 'rewrite'.
+        fields: The fields of the event. They are written as the members of the JSON object.
+
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ A formatter which writes each record as a JSON object in a line.
+
+    The object has 'time', 'level', 'logger' and 'event' (the message),
+    followed by the fields given to log_event.
+    The values which are not JSON serializable are written as strings.
+
+    """
+    def format(self, record):
+        entry = {
+                'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+def enable_json_log(target=None, level=logging.DEBUG, capacity=1024):
+    """ Writes the events of the loggers of this package as JSON lines.
+
+    The records are buffered and written every capacity records,
+    when a record of WARNING or higher arrives, and when disable_json_log is called.
+
+    Args:
+        target(str, file object or None): A path to the log file, or a file object.
+                                          If None, sys.stderr is used.
+        level(int): The minimum level of the events to be written.
+        capacity(int): The number of the records buffered.
+
+    Returns:
+        Handler: The handler added to the 'ggdl' logger. Pass it to disable_json_log.
+
+    """
+    if target is None:
+        target = sys.stderr
+    if isinstance(target, str):
+        stream_handler = logging.FileHandler(target, mode='a', encoding='utf-8')
+    else:
+        stream_handler = logging.StreamHandler(target)
+    stream_handler.setFormatter(JsonLinesFormatter())
+    handler = logging.handlers.MemoryHandler(capacity, flushLevel=logging.WARNING, target=stream_handler)
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
+
+def disable_json_log(handler):
+    """ Flushes and removes the handler added by enable_json_log. """
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.removeHandler(handler)
+    stream_handler = handler.target
+    handler.close()
+    stream_handler.close()
+    if not any(isinstance(h, logging.handlers.MemoryHandler) for h in logger.handlers):
+        logger.setLevel(logging.NOTSET)
@@ -1,6 +1,11 @@
 import os
+import logging
+import networkx as nx
 from graph_compiler import GraphCompiler
-from urdf_handler import UrdfHandler
+from urdf_handler import UrdfHandler, UrdfModuleIndex
+from structured_log import get_logger, log_event
+
+_logger = get_logger('urdf')
 
 class UrdfCompiler(GraphCompiler):
     """ A class for generating URDF files from graphs. 
@@ -27,6 +32,14 @@ class UrdfCompiler(GraphCompiler):
           if and only if the connector node is a root of the entire robot.
         * The rules need to generate graphs which meet the above assumptions.
 
+    The progress is printed when show_progress is True,
+    and logged as events of the 'ggdl.urdf' logger (see structured_log.py) in any case.
+    The events of the applied rules are DEBUG, and the others are INFO.
+
+    The kinds of the terminal symbols (URDF_NODE or CONNECTOR_NODE) are classified once
+    at the initialization, and generate_urdf lowers the graph into a plan of the modules 
+    and the joints (see lower_graph) before writing the urdf file.
+
     Note:
         [ Terminology ] 
             * A node which has a file name as a label is called a urdf node.
@@ -40,48 +53,101 @@ class UrdfCompiler(GraphCompiler):
 
     
     """
-    def __init__(self, grammar_file_path, urdf_dir_path, initial_graph, chunk_size=100):
+    URDF_NODE = 'urdf'
+    CONNECTOR_NODE = 'connector'
+
+    def __init__(self, grammar_file_path, urdf_dir_path, initial_graph, chunk_size=100, 
+            graph_class=nx.DiGraph, show_progress=True, grammar_cache_dir=None, urdf_index_path=None,
+            worklist=False, batch=False, profiler=None, executor=None, executor_workers=None):
         """
         Args:
             grammar_file_path(str): A full path to the grammar file.
             urdf_dir_path(str): A full path to the directory where module urdf files are stored.
             initial_graph(str): A networkx graph object to be compiled into a urdf file.
             chunk_size(integer, optional): See the description of the GraphCompiler class.
+            graph_class(class, optional): See the description of the GraphCompiler class.
+            show_progress(bool, optional): If False, the progress of the compilation is not printed.
+            grammar_cache_dir(str or None, optional): See the description of the GraphCompiler class.
+            urdf_index_path(str or None, optional): A path to the index file of the module urdf files.
+                                                    See the description of the UrdfModuleIndex class.
+                                                    If None, all the module urdf files are parsed.
+            worklist(bool, optional): If True, auto_compile uses the worklist mode by default.
+            batch(bool, optional): If True, auto_compile uses the batch mode by default.
+            profiler(RuleProfiler or None, optional): See the description of the GraphCompiler class.
+            executor(Executor or None, optional): See the description of the GraphCompiler class.
+            executor_workers(int or None, optional): See the description of the GraphCompiler class.
 
         """
-        super().__init__(grammar_file_path, initial_graph, chunk_size)
+        super().__init__(grammar_file_path, initial_graph, chunk_size, graph_class, grammar_cache_dir, 
+                profiler, executor, executor_workers)
+        self.show_progress = show_progress
+        self.worklist = worklist
+        self.batch = batch
+        self.__symbol_kinds = {symbol: self.classify_symbol(symbol) 
+                for symbol in self.get_terminal_symbols()}
         if urdf_dir_path.endswith('/'):
             self.urdf_dir_path = urdf_dir_path
         else:
             self.urdf_dir_path = urdf_dir_path + '/'
         self.urdf_handler = UrdfHandler()
+        urdf_index = None
+        if urdf_index_path is not None:
+            urdf_index = UrdfModuleIndex(urdf_index_path)
         for filename in self.__get_urdf_filenames():
-            self.urdf_handler.add_urdf(self.__filename_to_fullpath(filename))
+            self.urdf_handler.add_urdf(self.__filename_to_fullpath(filename), urdf_index)
+        if urdf_index is not None:
+            urdf_index.save()
 
     def is_compilable(self):
         """ Check if the graph consists only of terminal symbols. """
         return self.is_sentence()
 
-    def auto_compile(self):
+    def auto_compile(self, worklist=None, batch=None):
         """ Applies all the applicable rules to the graph. 
+
+        By default, the first applicable rule in the order of the grammar is applied
+        to its first target repeatedly.
+        In the worklist mode, the nodes are rewritten one by one with a worklist
+        (see GraphCompiler.apply_rules_by_worklist), which avoids looking for the first applicable rule
+        over the whole graph after each rewrite.
+        In the batch mode, all the targets which do not overlap are rewritten at once in each round
+        (see GraphCompiler.apply_rules_by_rounds), which updates the match index once per round.
+        These modes are suitable for grammars whose results do not depend on the priority of the rules.
         
         Note:
             If there are no applicable rules and the graph still has a non-terminal symbol,
             this method calls an error.
             The grammar itself is responsible for causing / avoiding such a case.
+
+        Args:
+            worklist(bool or None, optional): If True, the worklist mode is used.
+                                              If None, the worklist member is used.
+            batch(bool or None, optional): If True, the batch mode is used unless the worklist mode is used.
+                                           If None, the batch member is used.
         
         """
-        print("[ AUTOCOMPILE START ]")
-        applicable_rule_dict = self.get_applicable_rule()
-        while not self.is_there_no_applicable_rules(applicable_rule_dict):
-            for rule_name in applicable_rule_dict:
-                if len(applicable_rule_dict[rule_name]) == 0:
-                    continue
-                print(' '*4 + "CHOSEN RULE: " + str(rule_name) + \
-                        " TARGET: " + str(applicable_rule_dict[rule_name][0]))
-                self.apply_rule(rule_name, applicable_rule_dict[rule_name][0])
-                break;
-            applicable_rule_dict = self.get_applicable_rule()
+        if worklist is None:
+            worklist = self.worklist
+        if batch is None:
+            batch = self.batch
+        batch = batch and not worklist
+        self.__print("[ AUTOCOMPILE START ]")
+        log_event(_logger, logging.INFO, 'autocompile_start', nodes=self.__count_nodes(), 
+                worklist=worklist, batch=batch)
+        report = self.show_progress or _logger.isEnabledFor(logging.DEBUG)
+        count = 0
+        if worklist:
+            count = self.apply_rules_by_worklist(self.__report_rule if report else None)
+        elif batch:
+            count = self.apply_rules_by_rounds(self.__report_rule if report else None)
+        else:
+            rule_name, target = self.get_first_applicable_rule()
+            while rule_name is not None:
+                if report:
+                    self.__report_rule(rule_name, target)
+                self.apply_rule(rule_name, target)
+                count += 1
+                rule_name, target = self.get_first_applicable_rule()
         if not self.is_compilable():
             error_text = "\033[31m"
             error_text = "[ FATAL ERROR ]\n"
@@ -93,20 +159,24 @@ class UrdfCompiler(GraphCompiler):
                         str(self.get_symbol(node_id)) + " )\n"
             error_text += "\033[0m"
             raise ValueError(error_text) 
-        print("[ AUTOCOMPILE DONE ]")
+        self.__print("[ AUTOCOMPILE DONE ]")
+        log_event(_logger, logging.INFO, 'autocompile_done', rewrites=count, nodes=self.__count_nodes())
 
-    def generate_urdf(self, robot_name="generated_robot", filename=None, rpy="0 0 3.14159265359"):
+    def generate_urdf(self, robot_name="generated_robot", filename=None, rpy="0 0 3.14159265359",
+            compress=None):
         """ Generates a urdf file from the graph (the __graph member). 
 
         When the graph contains a non-terminal symbol, the auto_compile method is called.
         
         Args:
             robot_name(str): the name of the generated robot.
-            filename(str, optional): a full path to a saved file.
+            filename(str, optional): a full path to a saved file, or a file object opened in text mode.
                                      When not given, the urdf file is saved at the current directory
                                      as "robot_name".urdf
             rpy(str): specifies rotational orientation between connectors.
                       the format is same as the rpy of the joint of URDF.
+            compress(bool or None, optional): If True, the file is compressed with gzip.
+                                              If None, the file is compressed when filename ends with '.gz'.
             
         
         """
@@ -116,114 +186,111 @@ class UrdfCompiler(GraphCompiler):
         if not self.is_compilable():
             self.auto_compile()
 
+        modules, joints, root = self.lower_graph()
+        UrdfHandler.write_robot_urdf(
+                filename, 
+                robot_name,
+                self.__iter_urdf_strings(modules, joints, rpy),
+                root[0],
+                root[1],
+                compress=compress
+                )
+        self.__print("[ COMPILE DONE ] output = " + str(filename))
+        log_event(_logger, logging.INFO, 'urdf_generated', robot_name=robot_name, output=str(filename),
+                modules=len(modules), joints=len(joints))
+
+    def lower_graph(self):
+        """ Lowers the compiled graph into a plan of the modules and the joints of the urdf file.
+
+        The urdf nodes are found through the symbol index and the symbol-kind table,
+        and the graph is walked once around each urdf node.
+        The graph must be compilable.
+
+        Returns:
+            tuple: (modules, joints, root)
+                modules(list): Tuples (urdf_filename, module_id) in the order of the output.
+                joints(list): Tuples (parent_module_id, parent_link, child_module_id, child_link).
+                root(tuple): (link, module_id) of the root link of the robot.
+
+        """
         graph = self.get_graph()
-        urdf_node_in_graph = self.__get_urdf_file_nodes()
+        modules = []
         module_connecting_edges = []
         urdf_ids = {}
         robot_root = None
 
-        for urdf_node_id in urdf_node_in_graph:
-            urdf_ids[urdf_node_id] = urdf_node_id
-            # For any urdf node, all the node connecting with it
-            # are regarded as connectors to other modules.
-            # To add joint sections into the resulting urdf file, 
-            # list up all the edges between connectors of other modules.
-            in_edges = list(graph.in_edges(urdf_node_id))
-            out_edges = list(graph.out_edges(urdf_node_id))
-            
-            leaf_connector_node_id = []
-            for edge in out_edges:
-                leaf_connector_node_id.append(edge[1])
-                urdf_ids[edge[1]] = urdf_node_id
-
-            # Checking the edges between connector nodes.
-            # Any connector nodes have only one outward edge and only one inward edge.
-            # In the case of the leaf connector, 
-            # the outward edge is nothing more than the rigid connection with another module.
-            for connector_node in leaf_connector_node_id:
-                #print("module = " + self.get_symbol(urdf_node_id) + " [" + str(urdf_node_id) + " ]" +\
-                #        " leaf = " + self.get_symbol(connector_node)+ " [" + str(connector_node) + " ]")
-                outward_edges = list(graph.out_edges(connector_node))
-                #print("  out_edges = " + str([(edge[1], self.get_symbol(edge[1])) for edge in outward_edges]))
-                if len(outward_edges) != 0:
-                    module_connecting_edges.append(outward_edges[0])
-
-            # In the case of the root connector,
-            # the inward edge is the connection betweeen anther module.
-            # Note that, all the connection are added to module_connecting_edges
-            # via above outward_edges check
-            # Therefore, no edges are added by checking the inward edges for the root connector. 
-            # However, in a compilable graph, there exists a connector node
-            # which is the root of the graph.
-            # Here, search for the root node.
-
-            if len(in_edges) == 0:
-                # In this case, the urdf node itself is a root.
-                robot_root = urdf_node_id 
-                #print("urdf root = " + str(robot_root) + " " + self.get_symbol(robot_root))
-            else:
-                root_connector_node_id = in_edges[0][0]
+        for symbol, urdf_node_ids in self.get_symbol_groups():
+            if self.__symbol_kinds.get(symbol) != self.URDF_NODE:
+                continue
+            for urdf_node_id in urdf_node_ids:
+                modules.append((symbol, urdf_node_id))
+                urdf_ids[urdf_node_id] = urdf_node_id
+                # For any urdf node, all the node connecting with it
+                # are regarded as connectors to other modules.
+                # To add joint sections into the resulting urdf file, 
+                # list up all the edges between connectors of other modules.
+
+                # Checking the edges between connector nodes.
+                # Any connector nodes have only one outward edge and only one inward edge.
+                # In the case of the leaf connector, 
+                # the outward edge is nothing more than the rigid connection with another module.
+                for edge in graph.out_edges(urdf_node_id):
+                    leaf_connector_node_id = edge[1]
+                    urdf_ids[leaf_connector_node_id] = urdf_node_id
+                    outward_edge = next(iter(graph.out_edges(leaf_connector_node_id)), None)
+                    if outward_edge is not None:
+                        module_connecting_edges.append(outward_edge)
+
+                # In the case of the root connector,
+                # the inward edge is the connection betweeen anther module.
+                # Note that, all the connection are added to module_connecting_edges
+                # via above outward edge check
+                # Therefore, no edges are added by checking the inward edges for the root connector. 
+                # However, in a compilable graph, there exists a connector node
+                # which is the root of the graph.
+                # Here, search for the root node.
+                in_edge = next(iter(graph.in_edges(urdf_node_id)), None)
+                if in_edge is None:
+                    # In this case, the urdf node itself is a root.
+                    robot_root = urdf_node_id 
+                    continue
+                root_connector_node_id = in_edge[0]
                 urdf_ids[root_connector_node_id] = urdf_node_id
-
-                inward_edges = list(graph.in_edges(root_connector_node_id))
-                if len(inward_edges) == 0:
+                if next(iter(graph.in_edges(root_connector_node_id)), None) is None:
                     robot_root = root_connector_node_id
-                    #print("connector root = " + str(robot_root) + " " + self.get_symbol(robot_root))
                     # A root connector registered as robot_root can have multiple outward edges.
                     # (not recommended though)
                     # For such cases, check the outward edges of robot_root 
                     # and register them in module_connecting_edges.
-                    outward_edges_of_robot_root = graph.out_edges(robot_root)
-                    for edge in outward_edges_of_robot_root:
+                    for edge in graph.out_edges(robot_root):
                         if edge[1] != urdf_node_id:
                             module_connecting_edges.append(edge)
 
+        # The module IDs of both ends are known only after all the urdf nodes are visited.
+        nodes = graph.nodes
+        joints = [(urdf_ids[start_id], nodes[start_id]['name'], urdf_ids[end_id], nodes[end_id]['name'])
+                for start_id, end_id in module_connecting_edges]
+        return modules, joints, (nodes[robot_root]['name'], urdf_ids[robot_root])
 
-        # Generating strings which describe the existing modules.
-        urdf_string_list = []
-
-        #print("urdf_node_in_graph = " + str([self.get_symbol(id) for id in urdf_node_in_graph]))
-        for urdf_node_id in urdf_node_in_graph:
-            #print("urdf_node_id = " + str(urdf_node_id))
-            urdf_filename = self.get_symbol(urdf_node_id)
-            urdf_string_list.append(self.urdf_handler.replace_id(urdf_filename, urdf_node_id))
-
-        for edge in module_connecting_edges:
-            #print("edge = ", end="")
-            #print(self.get_symbol(edge[0]) + "[ " + str(edge[0]) + " ] ",end="")
-            #print(self.get_symbol(edge[1]) + "[ " + str(edge[1]) + " ] ")
-            urdf_string_list.append(
-                    self.urdf_handler.create_fix_joint(
-                        urdf_ids[edge[0]],
-                        self.get_symbol(edge[0]),
-                        urdf_ids[edge[1]],
-                        self.get_symbol(edge[1]),
-                        rpy=rpy
-                        )
-                    )
-        #print("robot_root = " + str(robot_root) + " [ " + self.get_label(robot_root) + " ] ")
-        #print("urdf_ids = " + str(urdf_ids[robot_root]))
-        UrdfHandler.write_robot_urdf(
-                filename, 
-                robot_name,
-                urdf_string_list,
-                self.get_label(robot_root),
-                urdf_ids[robot_root]
-                )
-        print("[ COMPILE DONE ] output = " + filename)
+    def __iter_urdf_strings(self, modules, joints, rpy):
+        """ Yields the strings of the modules and the joints between them for the urdf file. """
+        for urdf_filename, module_id in modules:
+            yield self.urdf_handler.replace_id(urdf_filename, module_id)
+
+        for parent_id, parent_link, child_id, child_link in joints:
+            yield self.urdf_handler.create_fix_joint(parent_id, parent_link, child_id, child_link, rpy=rpy)
 
-    def __is_urdf_node(self, node_id):
-        """ Checks if the symbol of the given node ends with ".urdf". """
-        return self.get_symbol(node_id).endswith('.urdf')
+    def __print(self, string):
+        if self.show_progress:
+            print(string)
 
-    def __is_connector_node(self, node_id):
-        """ Checks if the given node represents a connector. """
-        return not self.__is_urdf_node(node_id)
+    def __count_nodes(self):
+        return self.count_terminal_symbol_node() + self.count_non_terminal_symbol_node()
 
-    def __get_urdf_in_graph(self):
-        """ Returns urdf_filenames contained in a file at grammar_file_path. """
-        return [self.get_symbol(node_id) for node_id in self.get_terminal_symbol_node() 
-                if self.get_symbol(node_id).endswith('.urdf')]
+    def __report_rule(self, rule_name, target):
+        log_event(_logger, logging.DEBUG, 'rewrite', rule=rule_name, target=target)
+        if self.show_progress:
+            print(' '*4 + "CHOSEN RULE: " + str(rule_name) + " TARGET: " + str(target))
 
     def __get_urdf_filenames(self, include_subdir=False):
         """ Get all the urdf files in the given directory at the initialization."""
@@ -238,10 +305,12 @@ class UrdfCompiler(GraphCompiler):
         """ Concatenates the given filename with the path to the urdf directory. """
         return self.urdf_dir_path + filename
 
-    def __get_urdf_file_nodes(self):
-        """ Returns IDs of nodes of which symbols are urdf filenames. """
-        return [node_id for node_id in self.get_terminal_symbol_node()
-                if self.__is_urdf_node(node_id)]
+    @classmethod
+    def classify_symbol(cls, symbol):
+        """ Returns URDF_NODE if the symbol ends with ".urdf", otherwise CONNECTOR_NODE. """
+        if symbol.endswith('.urdf'):
+            return cls.URDF_NODE
+        return cls.CONNECTOR_NODE
 
         
 
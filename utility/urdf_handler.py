@@ -1,4 +1,8 @@
 import os
+import gzip
+import json
+import hashlib
+import tempfile
 import xml.etree.ElementTree as ET
 from decorated_print import DecoratedPrint
 
@@ -52,20 +56,33 @@ class UrdfHandler():
 
         value(joints): list of strings corresponding to each joint name
 
+        value(templates): list of strings made by splitting the python section at '(id)'.
+        See compile_template.
+
         """
         self.urdf_files = {}
         self.links = {}
         self.joints = {}
+        self.templates = {}
 
-    def add_urdf(self, path):
+    def add_urdf(self, path, index=None):
         """ Adds an urdf file into the dictionary. 
+
+        Args:
+            path(string): A path to the urdf file.
+            index(UrdfModuleIndex or None): If given, the content of the file is read from the index
+                                            unless the file has been changed.
+                                            The lists in the index are shared, not copied.
         
         Returns:
             key(string): A key to access the content of the file.
 
 
         """
-        chk, str_list, link_list, joint_list = UrdfHandler.is_valid_urdf(path)
+        if index is None:
+            chk, str_list, link_list, joint_list = UrdfHandler.is_valid_urdf(path)
+        else:
+            chk, str_list, link_list, joint_list = index.get(path)
         if not chk:
             raise ValueError(DecoratedPrint.decorated_string(
                 "[Warning] The given file path(" \
@@ -76,6 +93,7 @@ class UrdfHandler():
         self.urdf_files[key] = str_list
         self.links[key] = link_list
         self.joints[key] = joint_list
+        self.templates[key] = UrdfHandler.compile_template(str_list)
         return key
 
     def remove_urdf(self, key):
@@ -89,6 +107,7 @@ class UrdfHandler():
             self.urdf_files.pop(key)
             self.links.pop(key)
             self.joints.pop(key)
+            self.templates.pop(key)
         else:
             raise ValueError(DecoratedPrint.decorated_string(
                 "[Warning] The given key(" \
@@ -98,18 +117,29 @@ class UrdfHandler():
 
     def replace_id(self, key, unique_id):
         """ Replaces 'id' for a number in urdf_file[key], and generates a concatenated string. 
+
+        The string is rendered from templates[key] by a single join.
         
         Args:
             key(string): A key for the dictionaries
             unique_id(Integer): A number for the unique module ID
         
         """
-        str_list = self.urdf_files[key]
-        new_list = []
-        for s in str_list:
-            new_list.append(s.replace('(id)', '(' + str(unique_id) + ')'))
+        return ('(' + str(unique_id) + ')').join(self.templates[key])
 
-        return UrdfHandler.concatenate_string_list(new_list)
+    @classmethod
+    def compile_template(cls, str_list):
+        """ Compiles lines into a template for replace_id.
+
+        The lines are concatenated and split at every '(id)'.
+        Joining the returned list with '(' + str(unique_id) + ')' gives the same string as
+        replacing '(id)' in each line and concatenating them.
+
+        Args:
+            str_list(list of string): Lines in the python section.
+
+        """
+        return UrdfHandler.concatenate_string_list(str_list).split('(id)')
 
     @classmethod
     def gen_key(cls, path):
@@ -245,19 +275,165 @@ class UrdfHandler():
 
 
     @classmethod
-    def write_robot_urdf(cls, filename, robot_name, str_list, first_link, first_id, indent_num=2):
+    def write_robot_urdf(cls, filename, robot_name, str_list, first_link, first_id, indent_num=2,
+            compress=None):
         """ Generates an urdf file for a robot.
 
+        The strings are written one by one as they are taken from str_list,
+        so str_list can be a generator producing the strings lazily.
+
         Args:
-            filename(string): A file name for the generated urdf file.
+            filename(string or file object): A file name for the generated urdf file,
+                                             or a file object opened in text mode.
             robot_name(string): the name for the robot.
-            str_list(list of string): strings to be written in robot tag.
+            str_list(iterable of string): strings to be written in robot tag.
+            compress(bool or None): If True, the file is compressed with gzip.
+                                    If None, the file is compressed when filename ends with '.gz'.
+                                    Ignored when filename is a file object.
 
         """
-        root_list = [UrdfHandler.write_header(robot_name, first_link, first_id, indent_num=indent_num), 
-                UrdfHandler.write_footer()]
-        root_list[1:1] = str_list
+        if hasattr(filename, 'write'):
+            UrdfHandler.stream_robot_urdf(
+                    filename, robot_name, str_list, first_link, first_id, indent_num=indent_num)
+            return
+        if compress is None:
+            compress = filename.endswith('.gz')
+        if compress:
+            f = gzip.open(filename, mode='wt')
+        else:
+            f = open(filename, mode='w')
+        with f:
+            UrdfHandler.stream_robot_urdf(
+                    f, robot_name, str_list, first_link, first_id, indent_num=indent_num)
+
+    @classmethod
+    def stream_robot_urdf(cls, f, robot_name, str_list, first_link, first_id, indent_num=2):
+        """ Writes an urdf file for a robot into the file object f.
+
+        The output is same as concatenating the header, str_list and the footer as lines.
+
+        Args:
+            f(file object): A file object opened in text mode.
+            robot_name(string): the name for the robot.
+            str_list(iterable of string): strings to be written in robot tag.
 
-        with open(filename, mode='w') as f:
-            f.write(UrdfHandler.concatenate_string_list(root_list))
+        """
+        f.write(UrdfHandler.write_header(robot_name, first_link, first_id, indent_num=indent_num))
+        for s in str_list:
+            f.write('\n')
+            f.write(s)
+        f.write('\n')
+        f.write(UrdfHandler.write_footer())
  
+
+
+class UrdfModuleIndex():
+    """ A persistent index of the python sections of module urdf files.
+
+    Reading the module urdf files, finding the python section and parsing it
+    are needed only when the files are changed.
+    This class stores the results of UrdfHandler.is_valid_urdf in a JSON file,
+    and reuses them while the files are unchanged.
+
+    A file is regarded as unchanged when its size and mtime are same as the ones in the index.
+    Otherwise, the SHA-256 hash of the content is compared, and the file is parsed again
+    only when the hash differs.
+
+    The index file is written into a temporary file and renamed by save,
+    so the processes reading the index never see a partially written file.
+    Once the index is up to date, it is only read, and can be shared by any number of processes.
+
+    Attributes:
+        index_path(string): A path to the index file.
+        entries(dict): A dictionary which takes the absolute path to a urdf file
+                       and returns a dictionary with 'mtime_ns', 'size', 'sha256',
+                       'section', 'links' and 'joints'.
+        modified(bool): True if the entries are changed after loading.
+
+    """
+    format_version = 1
+
+    def __init__(self, index_path):
+        """
+        Args:
+            index_path(string): A path to the index file. 
+                                If the file does not exist or is broken, the index starts empty.
+
+        """
+        self.index_path = index_path
+        self.entries = {}
+        self.modified = False
+        try:
+            with open(index_path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(content, dict) and content.get('version') == self.format_version:
+            self.entries = content.get('modules', {})
+
+    def get(self, path):
+        """ Returns the result of UrdfHandler.is_valid_urdf for the file, using the index if possible.
+
+        Args:
+            path(string): A path to the urdf file.
+
+        """
+        key = os.path.abspath(path)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return False, None, None, None
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                return True, entry['section'], entry['links'], entry['joints']
+            sha256 = self.__hash_file(key)
+            if entry['sha256'] == sha256:
+                entry['mtime_ns'] = stat.st_mtime_ns
+                entry['size'] = stat.st_size
+                self.modified = True
+                return True, entry['section'], entry['links'], entry['joints']
+        else:
+            sha256 = self.__hash_file(key)
+
+        chk, str_list, link_list, joint_list = UrdfHandler.is_valid_urdf(key)
+        if chk:
+            self.entries[key] = {
+                    'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'sha256': sha256,
+                    'section': str_list,
+                    'links': link_list,
+                    'joints': joint_list}
+            self.modified = True
+        elif key in self.entries:
+            self.entries.pop(key)
+            self.modified = True
+        return chk, str_list, link_list, joint_list
+
+    def save(self, force=False):
+        """ Writes the index file if the entries are modified.
+
+        Args:
+            force(bool): If True, the file is written even when the entries are not modified.
+
+        """
+        if not (self.modified or force):
+            return
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': self.format_version, 'modules': self.entries}, f)
+            os.replace(temp_path, self.index_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.modified = False
+
+    @classmethod
+    def __hash_file(cls, path):
+        """ Returns the SHA-256 hash of the content of the file. """
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()